@@ -83,9 +83,67 @@ endif
 if !exists('g:ticker_refresh_interval_minutes')
   let g:ticker_refresh_interval_minutes = 120
 endif
+" Refresh intervals in minutes for particular ticker symbols,
+" or for the groups of symbols named in g:ticker_refresh_groups.
+if !exists('g:ticker_refresh_intervals')
+  let g:ticker_refresh_intervals = {}
+endif
+if !exists('g:ticker_refresh_groups')
+  let g:ticker_refresh_groups = {}
+endif
 if !exists('g:ticker_quote_cache_file')
   let g:ticker_quote_cache_file = expand('~/.vim/ticker/ticker_cache.json')
 endif
+" The format of the quote cache file: 'json' or 'binary'.
+if !exists('g:ticker_cache_format')
+  let g:ticker_cache_format = 'json'
+endif
+
+" Number of quotes to request from Finnhub concurrently
+" during a refresh. 1 fetches the quotes one at a time.
+if !exists('g:ticker_fetch_workers')
+  let g:ticker_fetch_workers = 4
+endif
+
+" When the portfolio changes, fetch only the added symbols,
+" rather than refreshing every symbol.
+if !exists('g:ticker_incremental_refresh')
+  let g:ticker_incremental_refresh = 1
+endif
+
+" The socket of the quote daemon, if one is running.
+" Otherwise, quotes are fetched from within Vim.
+if !exists('g:ticker_daemon_socket')
+  let g:ticker_daemon_socket = ''
+endif
+
+" Stream real-time prices from the Finnhub WebSocket trade
+" feed while displaying, in addition to the periodic refresh.
+if !exists('g:ticker_stream')
+  let g:ticker_stream = 0
+endif
+if !exists('g:ticker_stream_url')
+  let g:ticker_stream_url = 'wss://ws.finnhub.io'
+endif
+
+" How quotes are refreshed while displaying: 'thread' uses
+" a pool of worker threads, 'asyncio' uses an event loop
+" with non-blocking HTTP.
+if !exists('g:ticker_refresh_engine')
+  let g:ticker_refresh_engine = 'thread'
+endif
+
+" Display the cached quotes at once, marking the expired ones
+" as stale, while they are refreshed in the background.
+if !exists('g:ticker_stale_while_revalidate')
+  let g:ticker_stale_while_revalidate = 1
+endif
+
+" How often, in milliseconds, to check whether the background
+" refresh has new quotes to display.
+if !exists('g:ticker_poll_interval_ms')
+  let g:ticker_poll_interval_ms = 200
+endif
 
 " Colors for displaying gain/loss.
 if !exists('g:ticker_up_highlight')
@@ -94,9 +152,29 @@ endif
 if !exists('g:ticker_down_highlight')
   let g:ticker_down_highlight = 'ctermbg=Red ctermfg=Gray'
 endif
+if !exists('g:ticker_stale_highlight')
+  let g:ticker_stale_highlight = 'ctermbg=DarkGray ctermfg=White'
+endif
 
 exe 'highlight tickerUpHi ' . g:ticker_up_highlight
 exe 'highlight tickerDownHi ' . g:ticker_down_highlight
+exe 'highlight tickerStaleHi ' . g:ticker_stale_highlight
+
+" How to display the portfolio: 'popups' shows each symbol in
+" a popup of its own, 'single' shows the whole portfolio in one
+" popup, highlighted with text properties.
+if !exists('g:ticker_display_mode')
+  let g:ticker_display_mode = 'popups'
+endif
+
+for [s:type, s:group] in [['tickerUp', 'tickerUpHi'],
+                        \ ['tickerDown', 'tickerDownHi'],
+                        \ ['tickerStale', 'tickerStaleHi']]
+  if empty(prop_type_get(s:type))
+    call prop_type_add(s:type, {'highlight': s:group})
+  endif
+endfor
+unlet s:type s:group
 
 " Where to position the display in the parent window.
 if !exists('g:ticker_location')
@@ -113,14 +191,27 @@ endif
 let g:ticker_parameters = {
 \  'rest_api_key': g:ticker_rest_api_key,
 \  'refresh_interval_minutes': g:ticker_refresh_interval_minutes,
+\  'refresh_intervals': g:ticker_refresh_intervals,
+\  'refresh_groups': g:ticker_refresh_groups,
 \  'quote_cache_file': g:ticker_quote_cache_file,
+\  'cache_format': g:ticker_cache_format,
+\  'fetch_workers': g:ticker_fetch_workers,
+\  'refresh_engine': g:ticker_refresh_engine,
+\  'incremental_refresh': g:ticker_incremental_refresh,
+\  'daemon_socket': g:ticker_daemon_socket,
+\  'stream': g:ticker_stream,
+\  'stream_url': g:ticker_stream_url,
+\  'stale_while_revalidate': g:ticker_stale_while_revalidate,
 \}
 
 function! ticker#RefreshQuoteDataNow()
   py3 ticker.refresh_quote_data_now(vim.eval('g:ticker_parameters'), vim.eval('g:ticker_portfolio'))
+  call ticker#Redisplay()
+endfunction
+
+function! ticker#Redisplay()
   " If we're currently displaying, then force a refresh.
   if ticker#IsDisplaying()
-    call ticker#_Hide()
     call ticker#_Display()
   endif
 endfunction
@@ -132,10 +223,27 @@ function! ticker#GetTickerDisplayData()
   return g:ticker_display_data
 endfunction
 
+function! ticker#GetTickerDisplayRows()
+  " Read g:ticker_portfolio as a list of [text, color] pairs,
+  " in the order of the portfolio.
+  return py3eval("ticker.get_ticker_rows(vim.eval('g:ticker_parameters'), vim.eval('g:ticker_portfolio'))")
+endfunction
+
+function! ticker#GetTickerDisplayLines()
+  " Read g:ticker_portfolio as the lines of a single popup,
+  " with text properties for their highlights.
+  return py3eval("ticker.get_ticker_lines(vim.eval('g:ticker_parameters'), vim.eval('g:ticker_portfolio'))")
+endfunction
+
 let g:ticker_popup_winids = []
+" The row displayed by each popup: its text, color and options.
+let g:ticker_popup_rows = []
+" The display is active from Display until Hide, even while it has
+" no rows, and so no popups.
+let s:displaying = 0
 
 function! ticker#IsDisplaying()
-  return len(g:ticker_popup_winids) > 0
+  return s:displaying
 endfunction
 
 function! ticker#Display()
@@ -144,21 +252,42 @@ function! ticker#Display()
     return
   endif
 
+  let s:displaying = 1
   call ticker#_Display()
 
-  py3 ticker.start_display_refresh(vim.eval('g:ticker_parameters'))
+  py3 ticker.start_display_refresh(vim.eval('g:ticker_parameters'), vim.eval('g:ticker_portfolio'))
+  if !exists('s:poll_timer')
+    let s:poll_timer = timer_start(g:ticker_poll_interval_ms, 'ticker#_Poll', {'repeat': -1})
+  endif
+endfunction
+
+function! ticker#_Poll(timer)
+  " Echo the messages of the background refresh, and redraw from
+  " Vim's main loop when it has new quotes.
+  for l:message in py3eval('ticker.take_messages()')
+    echomsg l:message
+  endfor
+  if py3eval("ticker.poll_display_refresh(vim.eval('g:ticker_portfolio'))")
+    call ticker#Redisplay()
+  endif
 endfunction
 
 function! ticker#_Display()
+  if g:ticker_display_mode ==# 'single'
+    call ticker#_DisplaySingle()
+    return
+  endif
+
   let parentwidth = winwidth(0)
   let parentheight = winheight(0)
 
-  " Read the display data, possibly from cache.
-  let disp = ticker#GetTickerDisplayData()
+  " Read the display rows, possibly from cache. They are in the
+  " order of the portfolio, so each popup keeps its symbol.
+  let disp = ticker#GetTickerDisplayRows()
 
   " Determine the max width of a display string.
   let maxwidth = 0
-  for k in keys(disp)
+  for [k, v] in disp
     let w = strwidth(k)
     if w > maxwidth
       let maxwidth = w
@@ -173,15 +302,91 @@ function! ticker#_Display()
   " Cap the display height at max of parentheight,
   " number of display items.
   let maxheight = parentheight
-  if maxheight > len(keys(disp))
-    let maxheight = len(keys(disp))
+  if maxheight > len(disp)
+    let maxheight = len(disp)
   endif
 
-  let col = 0
-  let line = 0
+  let [col, line] = ticker#_Position(maxwidth, maxheight)
+
+  let rows = []
+  for [k, v] in disp
+    if line > parentheight
+      break
+    endif
+
+    let text = k
+    let opts = {
+     \ 'line': line,
+     \ 'col' : col,
+     \ 'maxheight': 1,
+     \ 'minheight': 1,
+     \ 'maxwidth': maxwidth,
+     \ 'minwidth': maxwidth,
+     \}
+    if v == 2
+      let color = 'tickerStaleHi'
+    elseif v
+      let color = 'tickerUpHi'
+    else
+      let color = 'tickerDownHi'
+    endif
+
+    call add(rows, {'text': text, 'color': color, 'opts': opts})
+
+    let line += 1
+  endfor
 
+  call ticker#_UpdatePopups(rows)
+endfunction
+
+function! ticker#_DisplaySingle()
+  let parentwidth = winwidth(0)
+  let parentheight = winheight(0)
+
+  " Read the display lines, possibly from cache.
+  let lines = ticker#GetTickerDisplayLines()
+  if empty(lines)
+    call ticker#_UpdatePopups([])
+    return
+  endif
+
+  " The lines are padded to the same width.
+  let maxwidth = strwidth(lines[0].text)
+  if maxwidth > parentwidth
+    let maxwidth = parentwidth
+  endif
+
+  let maxheight = parentheight
+  if maxheight > len(lines)
+    let maxheight = len(lines)
+  endif
+
+  let [col, line] = ticker#_Position(maxwidth, maxheight)
+
+  let opts = {
+   \ 'line': line,
+   \ 'col' : col,
+   \ 'maxheight': maxheight,
+   \ 'minheight': maxheight,
+   \ 'maxwidth': maxwidth,
+   \ 'minwidth': maxwidth,
+   \}
+
+  " One popup shows every line; its text properties color them.
+  call ticker#_UpdatePopups([{'text': lines, 'color': '', 'opts': opts}])
+endfunction
+
+function! ticker#_Position(maxwidth, maxheight)
   " Use g:ticker_location together with maxwidth and
   " maxheight to determine the starting col,line pair.
+  let parentwidth = winwidth(0)
+  let parentheight = winheight(0)
+  let maxwidth = a:maxwidth
+  let maxheight = a:maxheight
+
+  let col = 0
+  let line = 0
+
   if type(g:ticker_location) == v:t_string
     if g:ticker_location == 'topleft'
       let col = 0
@@ -210,40 +415,58 @@ function! ticker#_Display()
     let line = 1
   endif
 
-  for k in keys(disp)
-    if line > parentheight
-      return
-    endif
+  return [col, line]
+endfunction
 
-    let text = k
-    let opts = {
-     \ 'line': line,
-     \ 'col' : col,
-     \ 'maxheight': 1,
-     \ 'minheight': 1,
-     \ 'maxwidth': maxwidth,
-     \ 'minwidth': maxwidth,
-     \}
-    if disp[k]
-      let color = 'tickerUpHi'
+function! ticker#_UpdatePopups(rows)
+  " Show the rows in the existing popups, changing only what
+  " differs from the row each popup displays. Popups are created
+  " or closed only when the number of rows changes.
+  let i = 0
+  for row in a:rows
+    if i < len(g:ticker_popup_winids)
+      let winid = g:ticker_popup_winids[i]
+      let old = g:ticker_popup_rows[i]
+      if type(row.text) != type(old.text) || row.text !=# old.text
+        call popup_settext(winid, row.text)
+      endif
+      if row.opts != old.opts
+        call popup_setoptions(winid, row.opts)
+      endif
+      if row.color !=# old.color
+        call setwinvar(winid, '&wincolor', row.color)
+      endif
+      let g:ticker_popup_rows[i] = row
     else
-      let color = 'tickerDownHi'
+      let winid = popup_create(row.text, row.opts)
+      call setwinvar(winid, '&wincolor', row.color)
+      call add(g:ticker_popup_winids, winid)
+      call add(g:ticker_popup_rows, row)
     endif
-
-    let winid = popup_create(text, opts)
-    call setwinvar(winid, '&wincolor', color)
-    call add(g:ticker_popup_winids, winid)
-
-    let line += 1
+    let i += 1
   endfor
+
+  " Close the popups left over from a longer display.
+  if i < len(g:ticker_popup_winids)
+    for winid in remove(g:ticker_popup_winids, i, -1)
+      call popup_close(winid)
+    endfor
+    call remove(g:ticker_popup_rows, i, -1)
+  endif
 endfunction
 
 function ticker#Hide()
+  if exists('s:poll_timer')
+    call timer_stop(s:poll_timer)
+    unlet s:poll_timer
+  endif
+
   if !ticker#IsDisplaying()
     " Nothing to do.
     return
   endif
 
+  let s:displaying = 0
   py3 ticker.stop_display_refresh()
 
   call ticker#_Hide()
@@ -257,6 +480,7 @@ function! ticker#_Hide()
 
   " Popups are destroyed.
   let g:ticker_popup_winids = []
+  let g:ticker_popup_rows = []
 endfunction
 
 function! ticker#Toggle()
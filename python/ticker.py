@@ -27,303 +27,202 @@ Uses the Finnhub API client module to retrieve stock data for a
 pre-defined set of stock ticker symbols.
 """
 
-from datetime import datetime, timedelta
+import argparse
+import asyncio
 import json
-from pathlib import Path
+import os
 import re
+import signal
+import sys
+import tempfile
 import threading
 import time
-import finnhub
-import vim # pylint: disable=E0401
+from urllib.parse import urlencode
+from ticker_cache import (REFRESH_RETRY_SECONDS, REFRESH_BACKOFF_MAX_SECONDS,
+                          update_cache, due_tickers,
+                          merge_quotes, cache_lock, async_cache_lock,
+                          read_cache, write_cache,
+                          get_daemon_quotes, get_cached_quotes, cache_is_fresh,
+                          read_next_update, apply_trade, apply_trades)
+from ticker_common import (TIME_FORMAT, ENCODING, QUEUE_MESSAGES, report,
+                           take_messages)
+from ticker_daemon import QuoteDaemon
+from ticker_fetch import (FETCH_CANCEL, FetchCancelled, cancel_fetches,
+                          close_clients, get_async_quotes)
+from ticker_format import (FmtStringParser, compile_format, format_field,
+                           format_column, import_numpy)
+from ticker_loop import THREAD_JOIN_SECONDS, EventLoopThread
+from ticker_store import Quote, QuoteStore, pack_cache, unpack_cache
+from ticker_websocket import (websocket_accept, websocket_connect,
+                              websocket_send, websocket_receive)
 
 
-TIME_FORMAT = '%m-%d-%Y %H:%M:%S'
-ENCODING = 'utf-8'
 UPDATER = None
+# The updater threads never call into Vim. They set REDRAW when the
+# quotes change, and Vim's poll timer redraws the display from its
+# main loop, keeping DISPLAY_PORTFOLIO current as it does. Vim sets
+# REVALIDATE when it has displayed stale quotes, asking the updater
+# to refresh them without waiting for 'next_update'.
+REDRAW = threading.Event()
+REVALIDATE = threading.Event()
+DISPLAY_PORTFOLIO = {}
+# The threads that didn't stop within THREAD_JOIN_SECONDS. FETCH_CANCEL
+# stays set, and no new updater is started, until they have all ended.
+STOPPING = []
+DISPLAY_PARAMS = None
+STREAM_URL = 'wss://ws.finnhub.io'
+STREAM_REDRAW_SECONDS = 1.0
+STREAM_SUBSCRIBE_SECONDS = 1.0
+STREAM = None
+# The text property types that highlight the lines of the single
+# popup display, indexed by the values of get_ticker_data.
+DISPLAY_PROP_TYPES = ('tickerDown', 'tickerUp', 'tickerStale')
 
 
-def get_rest_quote(rest_api_key: str, ticker: str) -> dict:
-    """Use the REST API to retrieve a stock quote.
+def refresh_quote_data_now(params: dict, ticker_portfolio: dict):
+    """Refresh all quote data, writing a new quote cache file.
 
-    Given a Finnhub API key and a ticker symbol, retrieve
-    current quote data for that ticker symbol, returning
-    the quote dictionary.
+    Immediately fetch new quote data for the entire portfolio,
+    writing a new quote cache file.
 
     Args:
-      rest_api_key:
-        Finnhub REST API key
-      ticker:
-        Stock ticker symbol
-
-    Returns:
-      A dict populated with the Finnhub quote keys, with
-      one additional key for the 'ticker' itself.
-      https://finnhub.io/docs/api/quote
+      params:
+        The value of g:ticker_parameters.
+      ticker_portfolio:
+        The value of g:ticker_portfolio.
     """
-    quote = finnhub.Client(api_key=rest_api_key).quote(ticker)
-    quote['ticker'] = ticker
-    return quote
+    settle_stopping()
+    if get_daemon_quotes(params, ticker_portfolio.keys(), True) is None:
+        with cache_lock(params['quote_cache_file']):
+            update_cache(params, ticker_portfolio.keys())
 
 
-def calc_next_update(refresh_interval_minutes: int) -> str:
-    """Given the refresh interval, find the next refresh time.
+def refresh_due_quote_data(params: dict, ticker_portfolio: dict):
+    """Refresh the quote data that has expired.
 
-    Given the value of g:ticker_refresh_interval_minutes, use
-    the current time to find the next update time. Convert this
-    next update time to a string.
+    Fetch new quote data only for the symbols in the portfolio
+    whose cached quotes have expired, updating the quote cache file.
 
     Args:
-      refresh_interval_minutes:
-        The value of g:ticker_refresh_interval_minutes
-
-    Returns:
-      A string representing the next update time, formatted
-      using TIME_FORMAT.
+      params:
+        The value of g:ticker_parameters.
+      ticker_portfolio:
+        The value of g:ticker_portfolio.
     """
-    next_update = datetime.now() + timedelta(minutes=float(refresh_interval_minutes))
-    return next_update.strftime(TIME_FORMAT)
+    if get_daemon_quotes(params, ticker_portfolio.keys()) is None:
+        get_cached_quotes(params, ticker_portfolio.keys())
 
 
-def update_cache(params: dict, tickers: list) -> dict:
-    """Use the REST API to fetch quotes, updating the cache file.
+def next_retry_delay(quote_cache_file: str, delay: float) -> float:
+    """Find how long an updater waits before its next refresh.
 
-    Given g:ticker_parameters and the list of ticker symbols,
-    use the REST API to fetch a quote for each symbol, assembling
-    each quote into a dictionary.
+    After a refresh that leaves the quote cache fresh for
+    DISPLAY_PORTFOLIO, the updater waits REFRESH_RETRY_SECONDS before
+    any refresh requested through REVALIDATE. Otherwise, as when a
+    symbol has never been fetched, the wait doubles after each
+    refresh, up to REFRESH_BACKOFF_MAX_SECONDS.
 
     Args:
-      params:
-        The value of g:ticker_parameters.
-      tickers:
-        A list of stock ticker symbol strings.
+      quote_cache_file:
+        The value of g:ticker_quote_cache_file
+      delay:
+        The wait that followed the last refresh.
 
     Returns:
-      A dict of all the stock quotes, indexed by the ticker
-      symbol.
+      The number of seconds to wait after this refresh.
     """
-    quote_cache_dir = Path(params['quote_cache_file']).parent
-    if not quote_cache_dir.exists():
-        quote_cache_dir.mkdir(parents=True)
-    quotes = {}
-    quotes['next_update'] = calc_next_update(params['refresh_interval_minutes'])
-    for t in tickers:
-        quotes[t] = get_rest_quote(params['rest_api_key'], t)
-    with open(params['quote_cache_file'], 'w', encoding=ENCODING) as fp:
-        json.dump(quotes, fp, indent=2)
-    return quotes
+    quotes, next_update = read_cache(quote_cache_file)
+    if cache_is_fresh(quotes, next_update, list(DISPLAY_PORTFOLIO)):
+        return REFRESH_RETRY_SECONDS
+    return min(delay * 2.0, REFRESH_BACKOFF_MAX_SECONDS)
 
 
-def refresh_quote_data_now(params: dict, ticker_portfolio: dict):
-    """Refresh all quote data, writing a new quote cache file.
+def get_ticker_data(params: dict, ticker_portfolio: dict) -> dict:
+    """Retrieve quote data from cache, updating the cache as needed.
 
-    Immediately fetch new quote data for the entire portfolio,
-    writing a new quote cache file.
+    Attempt to retrieve the quote data for ticker_portfolio from
+    the quote daemon, if there is one, or else from cache. If the
+    set of keys in ticker_portfolio doesn't match the set of keys
+    stored in the quote cache file, then fetch and return new data.
+    If the 'next_update' timestamp from the quote cache has expired,
+    then fetch and return new data.
+
+    When params['stale_while_revalidate'] is enabled, the cached
+    quotes are returned at once instead, with the expired ones
+    marked as stale, and the updater is asked to refresh them in
+    the background. New data is fetched first only when none of the
+    portfolio's symbols is cached.
 
     Args:
       params:
         The value of g:ticker_parameters.
       ticker_portfolio:
         The value of g:ticker_portfolio.
-    """
-    update_cache(params, ticker_portfolio.keys())
-
-
-def get_cached_quotes(params: dict, tickers: list) -> dict:
-    """Read the stock quotes from cache, or retrieve new data.
 
-    If the quote cache file exists, read the cached data from the file.
-    If the JSON decode is successful and the set of tickers appearing
-    in the quote data matches that stored in the ticker parameter,
-    Then examine the next update time from the file. If the current time
-    is less than the next update time, then return the cached quote
-    data, else use tickers to request new quote data, updating the
-    cache.
+    Returns:
+      A dict mapping the formatted display data to a 0, 1 or 2. If the
+      formatted display data maps to 0, then the display area will
+      be highlighted with g:ticker_down_highlight. If it maps to 2,
+      the quote is stale, and the display area will be highlighted
+      with g:ticker_stale_highlight. Otherwise, the display area will
+      be highlighted with g:ticker_up_highlight.
+    """
+    settle_stopping()
+    tickers = list(ticker_portfolio)
+    stale_while_revalidate = int(params.get('stale_while_revalidate', 1))
+    quotes = get_daemon_quotes(params, tickers,
+                               wait=not stale_while_revalidate)
+    if quotes is not None:
+        stale = due_tickers(quotes, tickers) if stale_while_revalidate else ()
+        if stale:
+            revalidate()
+        return render_portfolio(quotes, ticker_portfolio, stale)
+
+    if stale_while_revalidate:
+        quotes, next_update = read_cache(params['quote_cache_file'])
+        if cache_is_fresh(quotes, next_update, tickers):
+            # Quotes that failed to refresh stay stale until retried.
+            return render_portfolio(quotes, ticker_portfolio,
+                                    due_tickers(quotes, tickers))
+        if any(t in quotes for t in tickers):
+            revalidate()
+            return render_portfolio(quotes, ticker_portfolio,
+                                    due_tickers(quotes, tickers))
+
+    quotes = get_cached_quotes(params, tickers)
+    return render_portfolio(quotes, ticker_portfolio)
+
+
+def get_ticker_rows(params: dict, ticker_portfolio: dict) -> list:
+    """Retrieve quote data as the rows of the display, in order.
+
+    The quote data is retrieved as by get_ticker_data. A Vim dict
+    doesn't keep the order of its keys, so the rows are returned as
+    a list, which keeps each quote in the same popup as the prices
+    change.
 
     Args:
       params:
         The value of g:ticker_parameters.
-      tickers:
-        A list of stock ticker symbol strings.
+      ticker_portfolio:
+        The value of g:ticker_portfolio.
 
     Returns:
-      A dict of all the stock quotes, indexed by the ticker
-      symbol.
-    """
-    quotes = {}
-    quote_cache_file = Path(params['quote_cache_file'])
-    if quote_cache_file.exists():
-        with open(quote_cache_file, 'r', encoding=ENCODING) as fp:
-            try:
-                quotes = json.load(fp)
-            except json.JSONDecodeError as jde:
-                print(f'ticker json decode error: {jde.msg} '
-                      f'line: {jde.lineno} col: {jde.colno}')
-            else:
-                next_update = datetime.strptime(quotes['next_update'],
-                                                TIME_FORMAT)
-                del quotes['next_update']
-
-        if quotes and set(quotes.keys()) == set(tickers):
-            for t in tickers:
-                quotes[t]['ticker'] = t
-            # Do the quotes need refreshing?
-            if next_update > datetime.now():
-                return quotes
-
-    # Refresh all the quote data, updating the quote cache file.
-    quotes = update_cache(params, tickers)
-    del quotes['next_update']
-    return quotes
-
-
-# Sample finnhub quote response:
-# {
-#   'c': 47.08,     # Current price          %c
-#   'd': 1.32,      # Change                 %d
-#   'dp': 2.8846,   # Percent change         %p
-#   'h': 47.116,    # High price of the day  %h
-#   'l': 46.02,     # Low price of the day   %l
-#   'o': 46.48,     # Open price of the day  %o
-#   'pc': 45.76,    # Previous close price   %C
-#   't': 1703192401
-# }
-
-FMT_PATTERN = (r'(?P<format_specifier>'
-               r'(?P<percent>[%])'
-               r'(?:(?P<minus>[-]))?'
-               r'(?:(?P<width>[\d]+))?'
-               r'(?:(?P<dot>[.])(?P<prec>[\d]+))?'
-               r'(?P<spec>[cdphloCt%])'
-               r')')
-
-class FmtStringParser:
-    """Performs format string search and replace.
-
-    In the style of printf formatting for floating-point numbers,
-    convert a format string consisting of arbitrary text and
-    format specifiers to its translated form.
-
-    The set of input format specifiers is defined in the
-    specifer_to_key variable below. When a specifier string is
-    encountered in the format string, the specifier is used as
-    an index to find the correct dict key for the quote response
-    data.
-
-    The form of the format specifier is %-8.2a, where the optional
-    '-' indicates right justification, '8' indicates a total field
-    width of 8 columns, the optional '.2' indicates the number of
-    digits after the decimal point, and 'a' indicates the format
-    specifier.
+      A list with a [text, color] pair per line, in the order of
+      ticker_portfolio. The color is 0, 1 or 2, as for the values of
+      get_ticker_data.
     """
-
-    regex = re.compile(FMT_PATTERN)
-
-    def process_specifier(self, quote_data: dict, mat: re.Match) -> str:
-        """Given a matched format specifier, compute its final form.
-
-        Given a dictionary containing a quote response and an re.Match object
-        for a single format specifier, provide the string corresponding to
-        the format specifier.
-
-        Args:
-         quote_data:
-           The dict encoded in Finnhub quote response format.
-         mat:
-           An re.Match object corresponding to a matched regular
-           expression from the format specifier string.
-
-        Returns:
-          A string formatted per the input specifier.
-        """
-        specifier_to_key = {
-                             'c': 'c',
-                             'd': 'd',
-                             'p': 'dp',
-                             'h': 'h',
-                             'l': 'l',
-                             'o': 'o',
-                             'C': 'pc',
-                             't': 'ticker',
-                             '%': '%'
-                           }
-        gd = mat.groupdict()
-        justify = 'r' if gd['minus'] else 'l'
-        width = int(gd['width']) if gd['width'] else 0
-        prec = int(gd['prec']) if gd['prec'] else 0
-
-        quote_data['%'] = '%' # %% translates to %
-        res = str(quote_data[specifier_to_key[gd['spec']]])
-
-        if gd['prec'] and '.' in res:
-            d = res.find('.')
-            after = prec - len(res[d+1:])
-            if after > 0:
-                # Not enough precision. Pad with 0's.
-                res += '0' * after
-            else:
-                # Too much precision. Need to truncate.
-                res = res[:d+1+prec]
-
-        if gd['width']:
-            # A width was specified.
-            if len(res) > width:
-                # Truncate res to width chars.
-                res = res[:width]
-            else:
-                # Pad res to width chars.
-                padding = ' ' * (width - len(res))
-                if justify == 'r':
-                    res = padding + res
-                else:
-                    res += padding
-
-        return res
-
-    def parse(self, quote_data: dict, fmt: str) -> str:
-        """Convert a format specifier string to its final form.
-
-        Given a dictionary containing quote responses and a format
-        specifier string, create and return the formatted output string.
-
-        Args:
-          quote_data:
-            The dict encoded in Finnhub quote response format.
-          fmt:
-            The format string containing arbitrary text and/or
-            format specifiers.
-
-        Returns:
-          The the resulting string from converting each of the
-          format specifiers.
-        """
-        res = ''
-        fmtlen = len(fmt)
-        pos = 0
-        while pos < fmtlen:
-            mat = self.regex.search(fmt, pos)
-            if mat:
-                start = mat.start()
-                if start > pos:
-                    # Copy fmt[pos:start] to result.
-                    res += fmt[pos:start]
-                res += self.process_specifier(quote_data, mat)
-                pos = mat.end()
-            else:
-                # Copy fmt[pos:] to result.
-                res += fmt[pos:]
-                pos = fmtlen
-
-        return res
+    return [[line, color] for line, color in
+            get_ticker_data(params, ticker_portfolio).items()]
 
 
-def get_ticker_data(params: dict, ticker_portfolio: dict) -> dict:
-    """Retrieve quote data from cache, updating the cache as needed.
+def get_ticker_lines(params: dict, ticker_portfolio: dict) -> list:
+    """Retrieve quote data as the lines of a single popup.
 
-    Attempt to retrieve the quote data for ticker_portfolio from
-    cache. If the set of keys in ticker_portfolio doesn't match
-    the set of keys stored in the quote cache file, then fetch and
-    return new data. If the 'next_update' timestamp from the quote
-    cache has expired, then fetch and return new data.
+    The quote data is retrieved as by get_ticker_data. Each line is
+    padded to the width of the longest, and highlighted by a text
+    property spanning the line, so that the whole portfolio can be
+    shown by one call to popup_create or popup_settext.
 
     Args:
       params:
@@ -332,124 +231,182 @@ def get_ticker_data(params: dict, ticker_portfolio: dict) -> dict:
         The value of g:ticker_portfolio.
 
     Returns:
-      A dict mapping the formatted display data to a 0 or 1. If the
-      formatted display data maps to 0, then the display area will
-      be highlighted with g:ticker_down_highlight. Otherwise, the
-      display area will be highlighted with g:ticker_up_highlight.
+      A list with a dict per line, holding the 'text' of the line and
+      its 'props', in the order of ticker_portfolio. The type of the
+      text property is 'tickerDown', 'tickerUp' or 'tickerStale', as
+      for the highlights of get_ticker_data.
+    """
+    disp = get_ticker_data(params, ticker_portfolio)
+    width = max(map(len, disp), default=0)
+    lines = []
+    for line, color in disp.items():
+        text = line.ljust(width)
+        lines.append({'text': text,
+                      'props': [{'col': 1,
+                                 'length': len(text.encode(ENCODING)),
+                                 'type': DISPLAY_PROP_TYPES[color]}]})
+    return lines
+
+
+def render_portfolio(quotes: QuoteStore, ticker_portfolio: dict,
+                     stale: list = ()) -> dict:
+    """Format the quotes for a whole portfolio.
+
+    The columns of the quotes are read from the store, the symbols
+    are grouped by format string, and each group is rendered in a
+    single pass by its compiled FmtTemplate.
+
+    Args:
+      quotes:
+        The QuoteStore of the stock quotes.
+      ticker_portfolio:
+        The value of g:ticker_portfolio.
+      stale:
+        The symbols whose quotes are marked as stale.
+
+    Returns:
+      A dict mapping the formatted display data to a 0, 1 or 2, as
+      for get_ticker_data, in the order of ticker_portfolio.
     """
-    res = {}
-    quotes = get_cached_quotes(params, ticker_portfolio.keys())
-    parser = FmtStringParser()
-    for quote in quotes:
-        formatted = parser.parse(quotes[quote], ticker_portfolio[quote])
-        res[formatted] = 0 if quotes[quote]['dp'] < 0.0 else 1
-    return res
+    fields = quotes.select(ticker_portfolio)
+    groups = {}
+    for row, t in enumerate(fields['ticker']):
+        groups.setdefault(ticker_portfolio[t], []).append(row)
+
+    lines = [''] * len(fields['ticker'])
+    for fmt, rows in groups.items():
+        group = fields
+        if len(rows) < len(lines):
+            group = {f: [values[r] for r in rows] for f, values in fields.items()}
+        rendered = compile_format(fmt).render_fields(group, len(rows))
+        for row, line in zip(rows, rendered):
+            lines[row] = line
+
+    stale = set(stale)
+    return {line: 2 if t in stale else 0 if dp < 0.0 else 1
+            for line, t, dp in zip(lines, fields['ticker'], fields['dp'])}
 
 
 class TickerUpdater:
     """Refresh Ticker display when refresh interval expires.
 
-    Waits for the 'next_update' timeout from the quote cache,
-    then updates the quote cache file and forces a display refresh.
+    Waits for the 'next_update' timeout from the quote cache, which
+    is the earliest expiry of any cached quote, then refetches the
+    expired quotes and requests a display refresh.
     """
 
     class TickerThread(threading.Thread):
         """Specialization of threading.Thread that updates the cache.
 
-        The thread waits on a condition variable that is set to expire
-        on 'next_update'. When the thread wakes, it checks to see the
-        cause of the wake, which may be a signal to quit or a timeout
-        of 'next_update'.
+        The thread waits on the wakeup event until 'next_update'.
+        When the thread wakes, it checks to see the cause of the wake,
+        which may be a signal to quit, a request to revalidate stale
+        quotes or a timeout of 'next_update'.
+
+        The wait is timed by a deadline on the monotonic clock, so it
+        is neither cut short nor stretched by changes to the system
+        clock, and it is recomputed whenever the wait returns early.
+
+        Starting and stopping are signalled with events: started is
+        set once the thread runs, and setting stopping, then wakeup,
+        tells the thread to quit. The thread is a daemon, so it never
+        holds up the exit of Vim.
         """
 
         def __init__(self, params: dict):
             """Initialize the threading object.
 
             The thread tracks the location of the quote cache file
-            and a condition variable that is set to expire on
-            'next_update'.
+            and the deadline of its next refresh.
 
             Args:
               params:
                 The value of g:ticker_parameters.
             """
-            super().__init__(name='ticker_updater')
-            self.running = False
-            self.time_to_stop = False
+            super().__init__(name='ticker_updater', daemon=True)
+            self.started = threading.Event()
+            self.stopping = threading.Event()
+            self.wakeup = threading.Event()
+            self.params = params
             self.quote_cache_file = params['quote_cache_file']
-            self.next_update = self.get_next_update_time(self.quote_cache_file)
-            self.cond_var = threading.Condition(threading.Lock())
+            self.deadline = self.get_deadline()
+            self.retry_at = 0.0
 
-        def get_next_update_time(self, quote_cache_file: str) -> datetime:
+        def get_next_update_time(self, quote_cache_file: str) -> float:
             """Determine the 'next_update' time.
 
-            If the quote cache file doesn't exist or if it has been
-            corrupted somehow such that it doesn't parse, then return
-            the current datetime. Otherwise, parse the 'next_update'
-            key from the quote cache, returning the corresponding
-            datetime.
-
             Args:
               quote_cache_file:
                 The value of g:ticker_quote_cache_file
 
             Returns:
-              The datetime object corresponding to the 'next_update'
-              key found in the file, or the current datetime object.
+              The result of read_next_update(quote_cache_file).
             """
-            quote_cache = Path(quote_cache_file)
-            if not quote_cache.exists():
-                return datetime.now()
-            quotes = {}
-            with open(quote_cache, 'r', encoding=ENCODING) as fp:
-                try:
-                    quotes = json.load(fp)
-                except json.JSONDecodeError as jde:
-                    print(f'ticker json decode error: {jde.msg} '
-                          f'line: {jde.lineno} col: {jde.colno}')
-            if quotes:
-                return datetime.strptime(quotes['next_update'], TIME_FORMAT)
-            return datetime.now()
+            return read_next_update(quote_cache_file)
+
+        def get_deadline(self) -> float:
+            """Determine the deadline for the next refresh.
+
+            Returns:
+              The 'next_update' time, converted from the wall clock
+              to time.monotonic().
+            """
+            next_update = self.get_next_update_time(self.quote_cache_file)
+            return time.monotonic() + (next_update - time.time())
 
         def run(self):
             """Sleep until 'next_update' or time to stop.
 
-            If we wake, and self.time_to_stop has been set, then
-            stop immediately. Otherwise, check the result from
-            waiting on our condition. If the variable was not signaled,
-            then we timed out and need to update the quote cache and
-            force a refresh of the popups.
-            """
-            self.running = True
+            If we wake, and self.stopping has been set, then
+            stop immediately. Otherwise, if the deadline has passed,
+            refresh the expired quotes and request a refresh of the
+            popups, else go back to waiting for what remains of it.
 
-            while True:
-                if self.time_to_stop:
-                    break
-                now = datetime.now()
-                if now >= self.next_update:
-                    vim.eval('ticker#RefreshQuoteDataNow()')
-                    self.next_update = \
-                        self.get_next_update_time(self.quote_cache_file)
-                else:
-                    sleep_for = self.next_update - now
-                    with self.cond_var:
-                        self.cond_var.wait(float(sleep_for.seconds))
-
-            self.running = False
+            After a refresh, the next deadline is at least the
+            next_retry_delay away, so that a refresh that leaves
+            quotes missing, such as one that couldn't reach Finnhub,
+            isn't retried in a tight loop. The same holds for a
+            refresh requested through REVALIDATE.
+            """
+            self.started.set()
+
+            retry_delay = REFRESH_RETRY_SECONDS
+            while not self.stopping.is_set():
+                if REVALIDATE.is_set():
+                    REVALIDATE.clear()
+                    self.deadline = self.retry_at
+                remaining = self.deadline - time.monotonic()
+                if remaining > 0.0:
+                    self.wakeup.wait(min(remaining, threading.TIMEOUT_MAX))
+                    self.wakeup.clear()
+                    continue
+                try:
+                    refresh_due_quote_data(self.params, DISPLAY_PORTFOLIO)
+                except FetchCancelled:
+                    continue
+                request_redraw()
+                retry_delay = next_retry_delay(self.quote_cache_file,
+                                               retry_delay)
+                self.retry_at = time.monotonic() + retry_delay
+                self.deadline = max(self.get_deadline(), self.retry_at)
 
         def is_running(self):
             """Is the thread still running?
             """
-            return self.running
+            return self.started.is_set() and self.is_alive()
 
-        def stop(self):
+        def stop(self) -> bool:
             """Tell the thread to stop, and wait for it to stop.
+
+            The wait is bounded by THREAD_JOIN_SECONDS.
+
+            Returns:
+              True if the thread stopped.
             """
-            self.time_to_stop = True
-            while self.running:
-                with self.cond_var:
-                    self.cond_var.notify()
-                time.sleep(0.01)
+            self.stopping.set()
+            self.wakeup.set()
+            self.join(THREAD_JOIN_SECONDS)
+            return not self.is_alive()
 
     def __init__(self, params: dict):
         """Create and start the updater thread.
@@ -461,11 +418,26 @@ class TickerUpdater:
         self.thread = TickerUpdater.TickerThread(params)
         self.thread.start()
 
-    def stop(self):
+    def stop(self) -> bool:
         """Stop and join the updater thread.
+
+        Returns:
+          True if the thread stopped within THREAD_JOIN_SECONDS.
+        """
+        return self.thread.stop()
+
+    def wake(self):
+        """Wake the updater thread to check for REVALIDATE.
+        """
+        self.thread.wakeup.set()
+
+    def wait_started(self, timeout: float) -> bool:
+        """Wait for the updater thread to start running.
+
+        Returns:
+          True if the thread started within timeout seconds.
         """
-        self.thread.stop()
-        self.thread.join()
+        return self.thread.started.wait(timeout)
 
     def is_running(self):
         """Is the updater thread still running?
@@ -473,41 +445,365 @@ class TickerUpdater:
         return self.thread.is_running()
 
 
-def start_display_refresh(params: dict):
+class AsyncTickerUpdater(EventLoopThread):
+    """Refresh Ticker display from an asyncio event loop.
+
+    An alternative to TickerUpdater, selected when
+    g:ticker_refresh_engine is 'asyncio'. A single coroutine,
+    running on the event loop's own thread, sleeps until
+    'next_update', fetches the expired quotes with non-blocking
+    HTTP, publishes the quotes to the cache file, then requests a
+    display refresh.
+    """
+
+    def __init__(self, params: dict):
+        """Create the event loop and start its thread.
+
+        Args:
+          params:
+            The value of g:ticker_parameters.
+        """
+        self.wakeup = None
+        self.retry_at = 0.0
+        super().__init__(params, 'ticker_async_updater')
+
+    def wake(self):
+        """Wake the event loop to check for REVALIDATE.
+        """
+        try:
+            self.loop.call_soon_threadsafe(self.set_wakeup)
+        except RuntimeError: # The event loop has already closed.
+            pass
+
+    def set_wakeup(self):
+        """Set the wakeup event, once main has created it.
+        """
+        if self.wakeup is not None:
+            self.wakeup.set()
+
+    async def main(self):
+        """Refresh the quote cache each time 'next_update' passes.
+
+        A refresh, including one requested through REVALIDATE, happens
+        no sooner than the next_retry_delay after the last refresh.
+
+        The quote cache file is read and written by the default
+        executor, so that the event loop never blocks, and stop can
+        always cancel the coroutine.
+        """
+        loop = asyncio.get_running_loop()
+        quote_cache_file = self.params['quote_cache_file']
+        self.wakeup = asyncio.Event()
+        revalidating = False
+        retry_delay = REFRESH_RETRY_SECONDS
+        while True:
+            if REVALIDATE.is_set():
+                REVALIDATE.clear()
+                revalidating = True
+            sleep_for = await loop.run_in_executor(
+                None, read_next_update, quote_cache_file) - time.time()
+            retry_in = self.retry_at - time.monotonic()
+            sleep_for = retry_in if revalidating else max(sleep_for, retry_in)
+            if sleep_for > 0.0:
+                # Check again on waking, in case the cache was
+                # refreshed while we slept.
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), sleep_for)
+                except asyncio.TimeoutError:
+                    pass
+                self.wakeup.clear()
+                continue
+            revalidating = False
+            tickers = list(DISPLAY_PORTFOLIO)
+            async with async_cache_lock(quote_cache_file):
+                quotes, next_update = await loop.run_in_executor(
+                    None, read_cache, quote_cache_file)
+                due = [] if cache_is_fresh(quotes, next_update, tickers) \
+                      else due_tickers(quotes, tickers)
+                if due:
+                    fetched = await get_async_quotes(self.params, due)
+                    await loop.run_in_executor(None, merge_quotes, self.params,
+                                               quotes, fetched, tickers)
+            request_redraw()
+            retry_delay = await loop.run_in_executor(
+                None, next_retry_delay, quote_cache_file, retry_delay)
+            self.retry_at = time.monotonic() + retry_delay
+
+
+class QuoteStream(EventLoopThread):
+    """Stream real-time trades into the cached quotes.
+
+    Subscribes to the Finnhub WebSocket trade feed for each symbol
+    in the portfolio. Each trade updates the current price, change
+    and percent change of the symbol's cached quote, and the display
+    is refreshed at most once every STREAM_REDRAW_SECONDS. The REST
+    refreshes continue as usual, so when the stream is down the
+    quotes are still refreshed on schedule. Lost connections are
+    retried with an increasing delay.
+    """
+
+    def __init__(self, params: dict):
+        """Create the event loop and start its thread.
+
+        Args:
+          params:
+            The value of g:ticker_parameters.
+        """
+        self.redraw_pending = False
+        self.last_error = None
+        super().__init__(params, 'ticker_stream')
+
+    async def main(self):
+        """Keep the trade stream connected.
+
+        An error is reported only when it differs from the last one
+        since the stream was connected, so that a stream retrying
+        while offline doesn't report each attempt.
+        """
+        delay = 1.0
+        while True:
+            try:
+                await self.stream_trades()
+                delay = 1.0
+            except Exception as exc: # pylint: disable=W0718
+                error = f'ticker stream error: {str(exc) or type(exc).__name__}'
+                if error != self.last_error:
+                    report(error)
+                    self.last_error = error
+            await asyncio.sleep(delay)
+            delay = min(delay * 2.0, 60.0)
+
+    async def stream_trades(self):
+        """Subscribe to the portfolio's trades, applying each of them.
+
+        The subscriptions follow DISPLAY_PORTFOLIO. The next message is
+        received by a task of its own, and while it is awaited, the
+        subscriptions are brought up to date every
+        STREAM_SUBSCRIBE_SECONDS.
+        """
+        url = f"{self.params.get('stream_url') or STREAM_URL}?" \
+              f"{urlencode({'token': self.params['rest_api_key']})}"
+        reader, writer = await websocket_connect(url)
+        self.last_error = None
+        subscribed = set()
+        receive = None
+        try:
+            while True:
+                await self.subscribe(writer, subscribed)
+                if receive is None:
+                    receive = asyncio.ensure_future(
+                        websocket_receive(reader, writer))
+                done, _ = await asyncio.wait({receive},
+                                             timeout=STREAM_SUBSCRIBE_SECONDS)
+                if not done:
+                    continue
+                message = receive.result()
+                receive = None
+                if message is None:
+                    break
+                message = json.loads(message)
+                if message.get('type') == 'trade' and \
+                   apply_trades(self.params['quote_cache_file'],
+                                message.get('data', [])) and \
+                   not self.redraw_pending:
+                    self.redraw_pending = True
+                    self.loop.call_later(STREAM_REDRAW_SECONDS, self.redraw)
+        finally:
+            if receive is not None:
+                receive.cancel()
+            writer.close()
+
+    @staticmethod
+    async def subscribe(writer: asyncio.StreamWriter, subscribed: set):
+        """Subscribe to the trades of the symbols in DISPLAY_PORTFOLIO.
+
+        The symbols added to the portfolio are subscribed, and those
+        removed from it are unsubscribed.
+
+        Args:
+          writer:
+            The connection's asyncio.StreamWriter.
+          subscribed:
+            The set of the subscribed symbols, updated in place.
+        """
+        tickers = list(DISPLAY_PORTFOLIO)
+        for t in [t for t in tickers if t not in subscribed]:
+            await websocket_send(writer, json.dumps({'type': 'subscribe',
+                                                     'symbol': t}))
+            subscribed.add(t)
+        for t in sorted(subscribed.difference(tickers)):
+            await websocket_send(writer, json.dumps({'type': 'unsubscribe',
+                                                     'symbol': t}))
+            subscribed.discard(t)
+
+    def redraw(self):
+        """Request a refresh of the display with the streamed quotes.
+        """
+        self.redraw_pending = False
+        request_redraw()
+
+
+def request_redraw():
+    """Ask Vim to refresh the display.
+
+    Called from the updater threads, which must not call into Vim.
+    The next poll_display_refresh returns 1, and Vim redraws.
+    """
+    REDRAW.set()
+
+
+def revalidate():
+    """Ask the updater to refresh the stale quotes in the background.
+
+    Called from Vim's main thread, after displaying stale quotes.
+    """
+    REVALIDATE.set()
+    if UPDATER is not None:
+        UPDATER.wake()
+
+
+def poll_display_refresh(ticker_portfolio: dict) -> int:
+    """Check for a display refresh requested by the updater threads.
+
+    Called by Vim's poll timer, on Vim's main thread, while the
+    display is active. The portfolio is handed to the updater
+    threads, so they refresh the symbols that are displayed.
+
+    Args:
+      ticker_portfolio:
+        The value of g:ticker_portfolio.
+
+    Returns:
+      1 if the display should be refreshed, else 0.
+    """
+    global DISPLAY_PORTFOLIO # pylint: disable=W0603
+    DISPLAY_PORTFOLIO = ticker_portfolio
+    if STOPPING:
+        start_updaters()
+    if not REDRAW.is_set():
+        return 0
+    REDRAW.clear()
+    return 1
+
+
+def start_display_refresh(params: dict, ticker_portfolio: dict):
     """Create the TickerUpdater object if it doesn't exist.
 
     Create the updater object, which creates the updater thread.
     The thread checks the value of 'next_update' from the quote
-    cache to determine whether data needs refreshing.
+    cache to determine whether data needs refreshing. When
+    params['refresh_engine'] is 'asyncio', an AsyncTickerUpdater
+    is created instead. When params['stream'] is enabled, the
+    QuoteStream is created, too.
+
+    The messages reported by the threads are queued, to be echoed
+    by Vim's poll timer with take_messages, until the display refresh
+    stops.
+
+    When the threads of an earlier display haven't stopped yet, the
+    objects are created by poll_display_refresh once they have.
 
     Args:
       params:
         The value of g:ticker_parameters.
+      ticker_portfolio:
+        The value of g:ticker_portfolio.
+    """
+    global DISPLAY_PARAMS, DISPLAY_PORTFOLIO # pylint: disable=W0603
+    DISPLAY_PARAMS = params
+    DISPLAY_PORTFOLIO = ticker_portfolio
+    REDRAW.clear()
+    QUEUE_MESSAGES.set()
+    start_updaters()
+
+
+def start_updaters():
+    """Create the updater objects for DISPLAY_PARAMS.
+
+    Nothing is created while a thread in STOPPING is still running,
+    so that no more than one updater refreshes the quotes, and so that
+    FETCH_CANCEL is cleared only when no cancelled thread is left.
     """
-    global UPDATER # pylint: disable=W0603
+    global UPDATER, STREAM # pylint: disable=W0603
+    if not settle_stopping() or DISPLAY_PARAMS is None:
+        return
+    if STREAM is None and int(DISPLAY_PARAMS.get('stream', 0)):
+        STREAM = QuoteStream(DISPLAY_PARAMS)
     if UPDATER is None:
-        UPDATER = TickerUpdater(params)
-        while not UPDATER.is_running():
-            time.sleep(0.01)
+        if DISPLAY_PARAMS.get('refresh_engine') == 'asyncio':
+            UPDATER = AsyncTickerUpdater(DISPLAY_PARAMS)
+        else:
+            UPDATER = TickerUpdater(DISPLAY_PARAMS)
+        UPDATER.wait_started(THREAD_JOIN_SECONDS)
+
+
+def settle_stopping() -> bool:
+    """Forget the threads in STOPPING that have ended.
+
+    Once none is left, FETCH_CANCEL is cleared, so that quotes can
+    be fetched again.
+
+    Returns:
+      True if no thread in STOPPING is still running.
+    """
+    STOPPING[:] = [thread for thread in STOPPING if thread.is_alive()]
+    if STOPPING:
+        return False
+    FETCH_CANCEL.clear()
+    return True
 
 
 def stop_display_refresh():
     """Stop the TickerUpdater object if it exists.
 
-    Wait for the updater thread to stop, then destroy the object.
+    Cancel the quote requests in flight, so that a refresh in progress
+    ends at once, then wait for the updater thread to stop, and
+    destroy the object. Do the same for the QuoteStream object, if it
+    exists. Finally, close the shared Finnhub clients, and print the
+    messages still queued.
+
+    A thread that doesn't stop within THREAD_JOIN_SECONDS is kept in
+    STOPPING, and FETCH_CANCEL stays set until it has ended, so that
+    it never updates the quote cache.
     """
-    global UPDATER # pylint: disable=W0603
-    if UPDATER is not None:
-        UPDATER.stop()
-        del UPDATER
-        UPDATER = None
+    global UPDATER, STREAM, DISPLAY_PARAMS # pylint: disable=W0603
+    DISPLAY_PARAMS = None
+    cancel_fetches()
+    for worker in (STREAM, UPDATER):
+        if worker is not None and not worker.stop():
+            STOPPING.append(worker.thread)
+    STREAM = None
+    UPDATER = None
+    close_clients()
+    REVALIDATE.clear()
+    settle_stopping()
+    QUEUE_MESSAGES.clear()
+    for message in take_messages():
+        print(message)
 
 
 if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(
+        description='Ticker quote daemon. Without --daemon, run self tests.')
+    arg_parser.add_argument('--daemon', action='store_true',
+                            help='serve quotes to Vim sessions')
+    arg_parser.add_argument('--socket',
+                            default='~/.vim/ticker/ticker.sock',
+                            help='the Unix domain socket to serve')
+    args = arg_parser.parse_args()
+    if args.daemon:
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        try:
+            QuoteDaemon(args.socket).serve()
+        except KeyboardInterrupt:
+            pass
+        sys.exit(0)
+
     #     'c'         'd'         'p'          'h'
     #     'l'         'o'          'C'
-    q = { 'c': 47.08, 'd': 1.32, 'dp': 2.8846, 'h': 47.116,
-          'l': 46.02, 'o': 46.48, 'pc': 45.76, 't': 1703192401 }
+    q = Quote.from_finnhub('MYSTOCK',
+        { 'c': 47.08, 'd': 1.32, 'dp': 2.8846, 'h': 47.116,
+          'l': 46.02, 'o': 46.48, 'pc': 45.76, 't': 1703192401 })
 
     p = FmtStringParser()
     assert p.parse(q, 'no specifiers') == 'no specifiers'
@@ -547,11 +843,117 @@ if __name__ == '__main__':
     assert p.parse(q, '%8.5p') == '2.88460 '
     assert p.parse(q, '%-8.5p') == ' 2.88460'
 
-    #params = {
-    #  'rest_api_key': 'blah',
-    #  'refresh_interval_minutes': 120,
-    #  'quote_cache_file': '/home/tswhison/.vim/ticker/ticker_cache.json',
-    #}
-    #start_display_refresh(params)
-    #time.sleep(5 * 60.0)
-    #stop_display_refresh(params)
+    # The compiled and the NumPy formatting agree with format_field.
+    samples = [q,
+               Quote.from_finnhub('DN', {'c': 9.5, 'd': -0.125, 'dp': -1.3,
+                                         'h': 10, 'l': -0.0001, 'o': 123456.75,
+                                         'pc': 9.625, 't': 1}),
+               Quote.from_finnhub('LONGNAME', {'c': 120, 'd': -10.0,
+                                               'dp': -7.6923, 't': 2})]
+    sample_fields = {f: [getattr(s, f) for s in samples] for f in Quote._fields}
+    for sample_fmt in ['%t %c', '%0c', '%0t|%0d', '%3c', '%.0p', '%.1d',
+                       '%.5d', '%6.2d', '%-6.2d', '%-9t %-8.3p%%', '%10.4C',
+                       '%4.1o', '%5t', '%-2t', 'no specifiers', '']:
+        expected = [p.regex.sub(lambda mat, s=s: p.process_specifier(s, mat),
+                                sample_fmt) for s in samples]
+        template = compile_format(sample_fmt)
+        assert [template.render(s) for s in samples] == expected, sample_fmt
+        assert template.render_many(samples) == expected, sample_fmt
+        if import_numpy() is not None:
+            assert template.render_columns(sample_fields, len(samples)) == \
+                   expected, sample_fmt
+
+    if import_numpy() is not None:
+        for column in (sample_fields['c'] + sample_fields['d'] +
+                       sample_fields['l'] + sample_fields['o'],
+                       sample_fields['ticker']):
+            for field_args in [(w, d, r) for w in (None, 0, 1, 3, 8)
+                               for d in (None, 0, 1, 2, 5)
+                               for r in (False, True)]:
+                assert format_column(column, *field_args).tolist() == \
+                       [format_field(v, *field_args) for v in column], \
+                       (column, field_args)
+
+    # The binary quote cache round trips, and a truncated one is refused.
+    cached = QuoteStore(s._replace(fetched=1703192401.5, expires=1703196001.25)
+                        for s in samples)
+    packed = pack_cache(cached, 1703196001.25)
+    unpacked, unpacked_next_update = unpack_cache(packed)
+    assert unpacked_next_update == 1703196001.25
+    assert dict(unpacked) == dict(cached)
+    for truncated in (packed[:8], packed[:-1]):
+        try:
+            unpack_cache(truncated)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError('read a truncated binary quote cache')
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        # Both formats are read back, and their 'next_update' is read
+        # from the head of the file. The copies aren't in memory.
+        for cache_format in ('json', 'binary'):
+            written = os.path.join(cache_dir, f'written.{cache_format}')
+            write_cache({'quote_cache_file': written,
+                         'cache_format': cache_format}, cached, 1703196001.25)
+            copied = os.path.join(cache_dir, f'copied.{cache_format}')
+            with open(written, 'rb') as src, open(copied, 'wb') as dst:
+                dst.write(src.read())
+            assert read_next_update(copied) == 1703196001.25, cache_format
+            assert read_cache(copied) == (cached, 1703196001.25), cache_format
+
+        # A quote cache written by earlier versions holds TIME_FORMAT
+        # times, and no 'expires' times.
+        legacy = os.path.join(cache_dir, 'legacy.json')
+        with open(legacy, 'w', encoding=ENCODING) as fp:
+            json.dump({'next_update': '12-21-2023 16:00:01',
+                       'MYSTOCK': {'c': 47.08, 'd': 1.32, 'dp': 2.8846,
+                                   'h': 47.116, 'l': 46.02, 'o': 46.48,
+                                   'pc': 45.76, 't': 1703192401}}, fp)
+        legacy_next_update = time.mktime(
+            time.strptime('12-21-2023 16:00:01', TIME_FORMAT))
+        assert read_next_update(legacy) == legacy_next_update
+        assert read_cache(legacy) == (
+            {'MYSTOCK': q._replace(expires=legacy_next_update)},
+            legacy_next_update)
+
+    # Stream trades from a local stand-in for the Finnhub trade feed.
+    async def trade_feed(reader, writer):
+        """Answer a subscription with a single trade."""
+        head = (await reader.readuntil(b'\r\n\r\n')).decode('ascii')
+        key = re.search(r'Sec-WebSocket-Key: (\S+)', head).group(1)
+        writer.write(('HTTP/1.1 101 Switching Protocols\r\n'
+                      'Upgrade: websocket\r\n'
+                      'Connection: Upgrade\r\n'
+                      f'Sec-WebSocket-Accept: {websocket_accept(key)}\r\n'
+                      '\r\n').encode('ascii'))
+        subscribe = json.loads(await websocket_receive(reader, writer))
+        trade = {'type': 'trade',
+                 'data': [{'s': subscribe['symbol'], 'p': 48.0, 't': 1}]}
+        await websocket_send(writer, json.dumps(trade), masked=False)
+        await websocket_send(writer, b'', 0x8, masked=False)
+        writer.close()
+
+    async def stream_trades() -> list:
+        """Subscribe to the stand-in feed, returning its messages."""
+        server = await asyncio.start_server(trade_feed, '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        reader, writer = await websocket_connect(f'ws://127.0.0.1:{port}/')
+        await websocket_send(writer, json.dumps({'type': 'subscribe',
+                                                 'symbol': 'MYSTOCK'}))
+        messages = []
+        message = await websocket_receive(reader, writer)
+        while message is not None:
+            messages.append(json.loads(message))
+            message = await websocket_receive(reader, writer)
+        writer.close()
+        server.close()
+        await server.wait_closed()
+        return messages
+
+    feed = asyncio.run(stream_trades())
+    assert feed == [{'type': 'trade',
+                       'data': [{'s': 'MYSTOCK', 'p': 48.0, 't': 1}]}]
+    streamed = apply_trade(q, feed[0]['data'][0]['p'])
+    assert (streamed.c, streamed.d, streamed.dp) == (48.0, 2.24, 4.8951)
+    assert p.parse(streamed, '$%.2c (%.2p%%)') == '$48.00 (4.89%)'
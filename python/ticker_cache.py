@@ -0,0 +1,765 @@
+# MIT License
+#
+# Copyright (c) 2023 Tim Whisonant
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""The quote cache file of the Ticker Vim plugin.
+
+The quote cache file is shared by every Vim session, and by the quote
+daemon, and is refreshed under a single-flight lease.
+"""
+
+import asyncio
+from contextlib import asynccontextmanager, contextmanager
+from datetime import datetime
+import json
+import mmap
+import os
+from pathlib import Path
+import socket
+from stat import S_IMODE
+import threading
+import time
+from ticker_common import TIME_FORMAT, ENCODING, report
+from ticker_fetch import FETCH_CANCEL, FetchCancelled, get_rest_quotes
+from ticker_store import (CACHE_MAGIC, CACHE_HEAD_SIZE, JSON_NEXT_UPDATE,
+                          Quote, parse_time, QuoteStore, pack_cache,
+                          unpack_cache, unpack_cache_header)
+
+
+QUOTE_CACHE = {}
+QUOTE_CACHE_LOCK = threading.Lock()
+REFRESH_LEASE_SECONDS = 120.0
+REFRESH_RETRY_SECONDS = 1.0
+REFRESH_BACKOFF_MIN_SECONDS = 5.0
+REFRESH_BACKOFF_MAX_SECONDS = 300.0
+DAEMON_TIMEOUT = 30.0
+DAEMON_DISPLAY_TIMEOUT = 1.0
+
+
+def calc_next_update(refresh_interval_minutes: int) -> float:
+    """Given the refresh interval, find the next refresh time.
+
+    Given the value of g:ticker_refresh_interval_minutes, use
+    the current time to find the next update time.
+
+    Args:
+      refresh_interval_minutes:
+        The value of g:ticker_refresh_interval_minutes
+
+    Returns:
+      The next update time, in seconds since the epoch.
+    """
+    return time.time() + float(refresh_interval_minutes) * 60.0
+
+
+def get_refresh_interval(params: dict, ticker: str) -> float:
+    """Find the refresh interval for a ticker symbol.
+
+    A symbol's entry in g:ticker_refresh_intervals takes precedence,
+    followed by the entry for a group in g:ticker_refresh_groups that
+    contains the symbol. Otherwise, the symbol is refreshed every
+    g:ticker_refresh_interval_minutes.
+
+    Args:
+      params:
+        The value of g:ticker_parameters.
+      ticker:
+        Stock ticker symbol
+
+    Returns:
+      The number of minutes between refreshes of ticker.
+    """
+    intervals = params.get('refresh_intervals') or {}
+    if ticker in intervals:
+        return float(intervals[ticker])
+    for group, symbols in (params.get('refresh_groups') or {}).items():
+        if ticker in symbols and group in intervals:
+            return float(intervals[group])
+    return float(params['refresh_interval_minutes'])
+
+
+def update_cache(params: dict, tickers: list) -> QuoteStore:
+    """Use the REST API to fetch quotes, updating the cache file.
+
+    Given g:ticker_parameters and the list of ticker symbols,
+    use the REST API to fetch a quote for each symbol, assembling
+    each quote into a dictionary. Quotes are fetched concurrently
+    when params['fetch_workers'] is greater than one.
+
+    Args:
+      params:
+        The value of g:ticker_parameters.
+      tickers:
+        A list of stock ticker symbol strings.
+
+    Returns:
+      The QuoteStore of all the stock quotes.
+    """
+    return merge_quotes(params, QuoteStore(), get_rest_quotes(params, tickers),
+                        tickers)
+
+
+def due_tickers(quotes: QuoteStore, tickers: list) -> list:
+    """Find the ticker symbols whose quotes need refreshing.
+
+    Args:
+      quotes:
+        The QuoteStore of the cached stock quotes.
+      tickers:
+        A list of stock ticker symbol strings.
+
+    Returns:
+      The list of symbols from tickers that are either missing
+      from quotes or whose cached quote has expired.
+    """
+    now = time.time()
+    return [t for t in tickers if t not in quotes or quotes[t].expires <= now]
+
+
+def merge_quotes(params: dict, quotes: QuoteStore, fetched: dict,
+                 tickers: list) -> QuoteStore:
+    """Merge newly fetched quotes into the cache, updating the cache file.
+
+    Each of the fetched quotes is stamped with its 'fetched' time
+    and, using its refresh interval, its 'expires' time. Cached
+    quotes that have expired but failed to refetch are kept as they
+    are, so they're still shown as stale. Cached quotes for symbols
+    that are no longer in tickers are dropped. The cache
+    'next_update' is the earliest of the 'expires' times of the
+    current quotes and the retry times of the failed ones.
+
+    A failed quote is retried after a backoff as long as it has been
+    expired, at least REFRESH_BACKOFF_MIN_SECONDS and at most
+    REFRESH_BACKOFF_MAX_SECONDS or its refresh interval, so the wait
+    roughly doubles with each failure while Finnhub can't be reached.
+    A symbol that has never been fetched is retried after
+    REFRESH_BACKOFF_MIN_SECONDS, and the updaters back off from there,
+    see next_retry_delay. So 'next_update' never waits out a full
+    refresh interval while any of tickers is missing.
+
+    The quotes are merged in place, so only the rows of the fetched
+    and expired quotes change. After cancel_fetches, nothing is
+    merged, so that the quotes that weren't fetched keep expiring.
+
+    Args:
+      params:
+        The value of g:ticker_parameters.
+      quotes:
+        The QuoteStore of the cached stock quotes.
+      fetched:
+        A dict of the newly fetched stock quotes, indexed by the
+        ticker symbol.
+      tickers:
+        A list of stock ticker symbol strings.
+
+    Returns:
+      quotes, updated, which is the new in-memory copy of the quote
+      cache.
+    """
+    if FETCH_CANCEL.is_set():
+        return quotes
+    now = time.time()
+    merged = []
+    retries = []
+    quotes.retain(tickers)
+    for t in tickers:
+        interval = get_refresh_interval(params, t)
+        if t in fetched:
+            merged.append(fetched[t]._replace(
+                fetched=now, expires=calc_next_update(interval)))
+        elif t in quotes and quotes[t].expires <= now:
+            backoff = min(max(now - quotes[t].expires,
+                              REFRESH_BACKOFF_MIN_SECONDS),
+                          REFRESH_BACKOFF_MAX_SECONDS, interval * 60.0)
+            retries.append(now + backoff)
+        elif t not in quotes:
+            retries.append(now + min(REFRESH_BACKOFF_MIN_SECONDS,
+                                     interval * 60.0))
+    quotes.update(merged)
+
+    updates = [e for e in quotes.select(tickers)['expires'] if e > now]
+    if updates or retries:
+        next_update = min(updates + retries)
+    else:
+        next_update = calc_next_update(params['refresh_interval_minutes'])
+    write_cache(params, quotes, next_update)
+    return quotes
+
+
+def write_cache(params: dict, quotes: QuoteStore, next_update: float):
+    """Write the quote cache file.
+
+    The quotes are written to a temporary file, which then replaces
+    the quote cache file, so that readers never see a partly written
+    quote cache. The temporary file takes the mode of the quote cache
+    file it replaces, or for a new quote cache, the mode given by the
+    umask. The file is written as JSON, or in the binary format
+    when params['cache_format'] is 'binary'. The quotes written also
+    become the in-memory copy of the quote cache, so they needn't be
+    read back from the file.
+
+    Times are written in seconds since the epoch. A JSON quote cache
+    also holds the 'next_update' time as a TIME_FORMAT local time,
+    for the benefit of people reading it, which Ticker ignores.
+
+    Args:
+      params:
+        The value of g:ticker_parameters.
+      quotes:
+        The QuoteStore of the stock quotes.
+      next_update:
+        The 'next_update' time, in seconds since the epoch.
+    """
+    quote_cache_dir = Path(params['quote_cache_file']).parent
+    if not quote_cache_dir.exists():
+        quote_cache_dir.mkdir(parents=True)
+    fd, temp_file = create_temp_file(quote_cache_dir)
+    try:
+        try:
+            os.chmod(temp_file,
+                     S_IMODE(os.stat(params['quote_cache_file']).st_mode))
+        except FileNotFoundError:
+            pass
+        if params.get('cache_format') == 'binary':
+            with open(fd, 'wb') as fp:
+                fp.write(pack_cache(quotes, next_update))
+        else:
+            with open(fd, 'w', encoding=ENCODING) as fp:
+                data = {'next_update': next_update,
+                        'next_update_local': datetime.fromtimestamp(
+                            next_update).strftime(TIME_FORMAT)}
+                data.update((t, q.to_cache()) for t, q in quotes.items())
+                json.dump(data, fp, indent=2)
+        os.replace(temp_file, params['quote_cache_file'])
+    except BaseException:
+        os.unlink(temp_file)
+        raise
+
+    remember_cache(params['quote_cache_file'], quotes, next_update)
+
+
+def create_temp_file(directory: Path) -> tuple:
+    """Create a uniquely named temporary file, as tempfile.mkstemp does.
+
+    Unlike mkstemp, which creates the file with mode 0600, the file
+    is created with the mode given by the umask, as open() does.
+
+    Args:
+      directory:
+        The directory in which to create the file.
+
+    Returns:
+      A tuple of the file descriptor, open for writing, and the path
+      of the file.
+    """
+    flags = os.O_CREAT | os.O_EXCL | os.O_WRONLY | getattr(os, 'O_BINARY', 0)
+    while True:
+        temp_file = str(directory / f'.ticker_cache.{os.urandom(6).hex()}')
+        try:
+            return os.open(temp_file, flags, 0o666), temp_file
+        except FileExistsError:
+            continue
+
+
+@contextmanager
+def cache_lock(quote_cache_file: str):
+    """Hold the lease that allows refreshing the quote cache.
+
+    Refreshes are single-flight: the lease is a file next to the
+    quote cache file naming its owner, so it is shared by every Vim
+    session using the same quote cache, and only its owner refreshes
+    the quotes. Everyone else waits for the owner to release the
+    lease, then reads the quote cache again, finding the quotes that
+    the owner fetched. A lease whose owner has exited, or which has
+    been held for more than REFRESH_LEASE_SECONDS, is broken.
+
+    Args:
+      quote_cache_file:
+        The value of g:ticker_quote_cache_file
+
+    Raises:
+      FetchCancelled: cancel_fetches was called while waiting for
+        the lease.
+    """
+    lock_file, lease = new_lease(quote_cache_file)
+    while not acquire_lease(lock_file, lease):
+        if FETCH_CANCEL.wait(0.1):
+            raise FetchCancelled('waiting for the refresh lease')
+    try:
+        yield
+    finally:
+        release_lease(lock_file, lease)
+
+
+@asynccontextmanager
+async def async_cache_lock(quote_cache_file: str):
+    """Hold the lease that allows refreshing the quote cache.
+
+    The same lease as cache_lock, for a coroutine: the lease is polled
+    with asyncio.sleep, so that the event loop keeps running, and the
+    wait can be cancelled, while another Vim session refreshes.
+
+    Args:
+      quote_cache_file:
+        The value of g:ticker_quote_cache_file
+    """
+    lock_file, lease = new_lease(quote_cache_file)
+    while not acquire_lease(lock_file, lease):
+        await asyncio.sleep(0.1)
+    try:
+        yield
+    finally:
+        release_lease(lock_file, lease)
+
+
+def new_lease(quote_cache_file: str) -> tuple:
+    """Describe a new refresh lease, owned by the calling thread.
+
+    Args:
+      quote_cache_file:
+        The value of g:ticker_quote_cache_file
+
+    Returns:
+      The path of the lease file, and the lease dict.
+    """
+    lock_file = Path(f'{quote_cache_file}.lock')
+    if not lock_file.parent.exists():
+        lock_file.parent.mkdir(parents=True)
+    lease = {
+              'pid': os.getpid(),
+              'thread': threading.get_ident(),
+              'expires': time.time() + REFRESH_LEASE_SECONDS
+            }
+    return lock_file, lease
+
+
+def release_lease(lock_file: Path, lease: dict):
+    """Give up the refresh lease, unless it has been broken.
+
+    Args:
+      lock_file:
+        The path of the lease file.
+      lease:
+        The lease dict, as taken by acquire_lease.
+    """
+    if read_lease(lock_file) == lease:
+        lock_file.unlink()
+
+
+def acquire_lease(lock_file: Path, lease: dict) -> bool:
+    """Try once to take the refresh lease.
+
+    Args:
+      lock_file:
+        The path of the lease file.
+      lease:
+        A dict identifying the new owner, and when the lease expires.
+
+    Returns:
+      True if the lease was taken. Otherwise, False, after breaking
+      the current lease if it is stale.
+    """
+    try:
+        fd = os.open(lock_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+    except FileExistsError:
+        owner = read_lease(lock_file)
+        if owner is not None and (owner['expires'] < time.time() or
+                                  not process_exists(owner.get('pid'))):
+            # Only break the lease that was found to be stale.
+            if read_lease(lock_file) == owner:
+                lock_file.unlink()
+        return False
+    with open(fd, 'w', encoding=ENCODING) as fp:
+        json.dump(lease, fp)
+    return True
+
+
+def read_lease(lock_file: Path) -> dict:
+    """Read the refresh lease.
+
+    Args:
+      lock_file:
+        The path of the lease file.
+
+    Returns:
+      The lease dict, or None if there is no lease. A lease file
+      that doesn't parse, because its owner is still writing it,
+      has no owner pid and expires REFRESH_LEASE_SECONDS after the
+      file was created.
+    """
+    try:
+        with open(lock_file, 'r', encoding=ENCODING) as fp:
+            return json.load(fp)
+    except FileNotFoundError:
+        return None
+    except json.JSONDecodeError:
+        try:
+            created = lock_file.stat().st_mtime
+        except FileNotFoundError:
+            return None
+        return {'expires': created + REFRESH_LEASE_SECONDS}
+
+
+def process_exists(pid: int) -> bool:
+    """Is the process with the given pid still running?
+
+    Where this can't be determined, the process is assumed to exist.
+    """
+    if pid is None or os.name != 'posix':
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def remember_cache(quote_cache_file: str, quotes: QuoteStore,
+                   next_update: float):
+    """Store the in-memory copy of the quote cache file.
+
+    The copy is tagged with the modification time and size of
+    the file, which read_cache uses to tell whether the copy is
+    still current.
+
+    Args:
+      quote_cache_file:
+        The value of g:ticker_quote_cache_file
+      quotes:
+        The QuoteStore of the cached stock quotes.
+      next_update:
+        The cached 'next_update' time.
+    """
+    stat = os.stat(quote_cache_file)
+    with QUOTE_CACHE_LOCK:
+        QUOTE_CACHE[str(quote_cache_file)] = \
+            ((stat.st_mtime_ns, stat.st_size), quotes, next_update)
+
+
+def read_cache(quote_cache_file: str) -> tuple:
+    """Read the quote cache file.
+
+    If the quote cache file doesn't exist or if it has been
+    corrupted somehow such that it doesn't parse, then there
+    are no cached quotes. Quotes cached before symbols had their
+    own 'expires' time are given the cache's 'next_update'.
+
+    The file may be in either format: a binary quote cache file is
+    recognized by its magic bytes, and it is read through an mmap.
+    So changing g:ticker_cache_format migrates the quote cache
+    when it is next written.
+
+    The parsed quote cache is kept in memory, and the file is
+    parsed again only when its modification time or size changes.
+    The QuoteStore is shared between callers, and it is updated in
+    place as the quotes are refreshed.
+
+    Args:
+      quote_cache_file:
+        The value of g:ticker_quote_cache_file
+
+    Returns:
+      A tuple of the QuoteStore of cached stock quotes and the
+      'next_update' time, in seconds since the epoch. With no cached
+      quotes, the 'next_update' is the current time.
+    """
+    try:
+        stat = os.stat(quote_cache_file)
+    except FileNotFoundError:
+        return QuoteStore(), time.time()
+    cached = QUOTE_CACHE.get(str(quote_cache_file))
+    if cached and cached[0] == (stat.st_mtime_ns, stat.st_size):
+        return cached[1], cached[2]
+
+    quotes = {}
+    with open(quote_cache_file, 'rb') as fp:
+        if fp.read(len(CACHE_MAGIC)) == CACHE_MAGIC:
+            try:
+                with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    quotes, next_update = unpack_cache(data)
+            except ValueError as exc:
+                report(f'ticker quote cache error: {exc}')
+                return QuoteStore(), time.time()
+            remember_cache(quote_cache_file, quotes, next_update)
+            return quotes, next_update
+        fp.seek(0)
+        try:
+            quotes = json.load(fp)
+        except json.JSONDecodeError as jde:
+            report(f'ticker json decode error: {jde.msg} '
+                   f'line: {jde.lineno} col: {jde.colno}')
+    if not quotes:
+        return QuoteStore(), time.time()
+
+    next_update = parse_time(quotes.pop('next_update'))
+    quotes.pop('next_update_local', None)
+    quotes = QuoteStore(Quote.from_cache(t, data, next_update)
+                        for t, data in quotes.items())
+    remember_cache(quote_cache_file, quotes, next_update)
+    return quotes, next_update
+
+
+def daemon_request(socket_path: str, request: dict,
+                   timeout: float = DAEMON_TIMEOUT) -> dict:
+    """Send one request to the quote daemon and read its response.
+
+    Args:
+      socket_path:
+        The path of the Unix domain socket of the daemon.
+      request:
+        The request, sent as a line of JSON.
+      timeout:
+        The number of seconds to wait for the daemon.
+
+    Returns:
+      The decoded response, or None if the daemon can't be reached.
+    """
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(os.path.expanduser(socket_path))
+            sock.sendall(json.dumps(request).encode(ENCODING) + b'\n')
+            with sock.makefile('rb') as fp:
+                return json.loads(fp.readline())
+    except (OSError, ValueError):
+        return None
+
+
+def ping_daemon(socket_path: str) -> bool:
+    """Determine whether a quote daemon is serving the socket.
+
+    Args:
+      socket_path:
+        The path of the Unix domain socket of the daemon.
+
+    Returns:
+      True if a daemon answered the ping, else False.
+    """
+    if not hasattr(socket, 'AF_UNIX'):
+        return False
+    response = daemon_request(socket_path, {'ping': True},
+                              DAEMON_DISPLAY_TIMEOUT)
+    return isinstance(response, dict) and response.get('pong', False)
+
+
+def get_daemon_quotes(params: dict, tickers: list, refresh: bool = False,
+                      wait: bool = True) -> QuoteStore:
+    """Request the stock quotes from the quote daemon.
+
+    When params['daemon_socket'] names the socket of a running
+    QuoteDaemon, the daemon provides the quotes in place of
+    get_cached_quotes.
+
+    Args:
+      params:
+        The value of g:ticker_parameters.
+      tickers:
+        A list of stock ticker symbol strings.
+      refresh:
+        If True, the daemon refreshes all of the quote data first,
+        as in refresh_quote_data_now.
+      wait:
+        If True, the daemon refreshes the expired quote data first,
+        as get_cached_quotes does. Otherwise, it answers at once with
+        the cached quotes, and leaves the refresh to its scheduler,
+        so the request is given only DAEMON_DISPLAY_TIMEOUT.
+
+    Returns:
+      The QuoteStore of all the stock quotes, or None if the
+      daemon isn't configured or can't be reached.
+    """
+    socket_path = params.get('daemon_socket')
+    if not socket_path or not hasattr(socket, 'AF_UNIX'):
+        return None
+    response = daemon_request(socket_path,
+                              {'params': params, 'tickers': list(tickers),
+                               'refresh': refresh, 'wait': wait},
+                              DAEMON_TIMEOUT if refresh or wait else
+                              DAEMON_DISPLAY_TIMEOUT)
+    if response is None:
+        return None
+    if 'error' in response:
+        report(f'ticker daemon error: {response["error"]}')
+        return None
+    return QuoteStore(Quote.from_cache(t, data, 0.0)
+                      for t, data in response['quotes'].items())
+
+
+def get_cached_quotes(params: dict, tickers: list) -> QuoteStore:
+    """Read the stock quotes from cache, or retrieve new data.
+
+    If the quote cache file exists, read the cached data from the file.
+    If the JSON decode is successful and the set of tickers appearing
+    in the quote data matches that stored in the ticker parameter,
+    Then examine the next update time from the file. If the current time
+    is less than the next update time, then return the cached quote
+    data, else request new quote data for the symbols whose quotes
+    have expired, updating the cache.
+
+    When params['incremental_refresh'] is enabled, a change to the set
+    of tickers is applied to the cache by fetching only the added
+    symbols, rather than by a full refresh.
+
+    Requests for new quote data are made while holding cache_lock,
+    so that concurrent Vim sessions don't each refresh the cache.
+
+    Args:
+      params:
+        The value of g:ticker_parameters.
+      tickers:
+        A list of stock ticker symbol strings.
+
+    Returns:
+      The QuoteStore of all the stock quotes.
+    """
+    tickers = list(tickers)
+    quotes, next_update = read_cache(params['quote_cache_file'])
+    if cache_is_fresh(quotes, next_update, tickers):
+        return quotes
+
+    with cache_lock(params['quote_cache_file']):
+        # Another Vim may have refreshed the cache while we waited.
+        quotes, next_update = read_cache(params['quote_cache_file'])
+        if cache_is_fresh(quotes, next_update, tickers):
+            return quotes
+
+        if quotes and (set(quotes.keys()) == set(tickers) or
+                       int(params.get('incremental_refresh', 1))):
+            # Refresh the expired and added quote data.
+            fetched = get_rest_quotes(params, due_tickers(quotes, tickers))
+            quotes = merge_quotes(params, quotes, fetched, tickers)
+        else:
+            # Refresh all the quote data, updating the quote cache file.
+            quotes = update_cache(params, tickers)
+    return quotes
+
+
+def cache_is_fresh(quotes: QuoteStore, next_update: float, tickers: list) -> bool:
+    """Can the cached quotes be used as they are?
+
+    Args:
+      quotes:
+        The QuoteStore of the cached stock quotes.
+      next_update:
+        The cached 'next_update' time.
+      tickers:
+        A list of stock ticker symbol strings.
+
+    Returns:
+      True when quotes holds exactly the symbols in tickers, and
+      none of them has expired.
+    """
+    return bool(quotes) and set(quotes.keys()) == set(tickers) and \
+           next_update > time.time()
+
+
+def read_next_update(quote_cache_file: str) -> float:
+    """Determine the 'next_update' time.
+
+    If the quote cache file doesn't exist or if it has been
+    corrupted somehow such that it doesn't parse, then return
+    the current time. Otherwise, parse the 'next_update'
+    key from the quote cache, returning the corresponding
+    time. This is the earliest time at which one of the
+    cached quotes expires.
+
+    This is called each time the updaters wake, so it avoids reading
+    the quotes. When the file's modification time and size match
+    the in-memory copy of the quote cache, the copy's 'next_update'
+    is used. Otherwise, 'next_update' is read from the head of the
+    file, and only a file whose head doesn't hold it is parsed.
+
+    Args:
+      quote_cache_file:
+        The value of g:ticker_quote_cache_file
+
+    Returns:
+      The 'next_update' time found in the file, or the current
+      time, in seconds since the epoch.
+    """
+    try:
+        stat = os.stat(quote_cache_file)
+        cached = QUOTE_CACHE.get(str(quote_cache_file))
+        if cached and cached[0] == (stat.st_mtime_ns, stat.st_size):
+            return cached[2]
+        with open(quote_cache_file, 'rb') as fp:
+            head = fp.read(CACHE_HEAD_SIZE)
+    except FileNotFoundError:
+        return time.time()
+    try:
+        if head.startswith(CACHE_MAGIC):
+            return unpack_cache_header(head)[2]
+        mat = JSON_NEXT_UPDATE.match(head)
+        if mat:
+            return parse_time(json.loads(mat.group(1)))
+    except ValueError:
+        pass
+    return read_cache(quote_cache_file)[1]
+
+
+def apply_trade(quote: Quote, price: float) -> Quote:
+    """Update a quote with the price of a trade.
+
+    Args:
+      quote:
+        The Quote.
+      price:
+        The price of the latest trade.
+
+    Returns:
+      A new Quote, with its current price 'c' set to price,
+      and its change 'd' and percent change 'dp' recomputed from
+      its previous close 'pc'.
+    """
+    d = round(price - quote.pc, 4)
+    return quote._replace(c=float(price), d=d,
+                          dp=round(d / quote.pc * 100.0, 4))
+
+
+def apply_trades(quote_cache_file: str, trades: list) -> bool:
+    """Update the in-memory quote cache with streamed trades.
+
+    The quote cache file isn't written, so the streamed prices
+    last until the quotes are next fetched using the REST API.
+
+    Args:
+      quote_cache_file:
+        The value of g:ticker_quote_cache_file
+      trades:
+        The 'data' list of a Finnhub trade message, holding
+        the symbol 's' and price 'p' of each trade.
+
+    Returns:
+      True if any of the cached quotes changed.
+    """
+    prices = {trade['s']: trade['p'] for trade in trades}
+    with QUOTE_CACHE_LOCK:
+        cached = QUOTE_CACHE.get(str(quote_cache_file))
+    if not cached:
+        return False
+    quotes = cached[1]
+    updated = [apply_trade(q, prices[q.ticker])
+               for q in map(quotes.get, prices) if q and q.pc and
+               q.c != prices[q.ticker]]
+    quotes.update(updated)
+    return bool(updated)
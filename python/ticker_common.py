@@ -0,0 +1,66 @@
+# MIT License
+#
+# Copyright (c) 2023 Tim Whisonant
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Definitions shared by the modules of the Ticker Vim plugin.
+"""
+
+import threading
+
+
+TIME_FORMAT = '%m-%d-%Y %H:%M:%S'
+ENCODING = 'utf-8'
+# The background threads must not call into Vim, even to print. While
+# QUEUE_MESSAGES is set, their messages are queued, and Vim's poll
+# timer echoes them from the main thread.
+QUEUE_MESSAGES = threading.Event()
+MESSAGES = []
+MESSAGES_LOCK = threading.Lock()
+
+
+def report(message: str):
+    """Report an error message to the user.
+
+    While QUEUE_MESSAGES is set, the message is queued for
+    take_messages, else it is printed.
+
+    Args:
+      message:
+        The message to report.
+    """
+    with MESSAGES_LOCK:
+        if QUEUE_MESSAGES.is_set():
+            MESSAGES.append(message)
+            return
+    print(message)
+
+
+def take_messages() -> list:
+    """Remove the queued messages.
+
+    Returns:
+      The list of the messages reported since the last call, in
+      the order they were reported.
+    """
+    with MESSAGES_LOCK:
+        messages = MESSAGES[:]
+        MESSAGES.clear()
+    return messages
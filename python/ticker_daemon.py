@@ -0,0 +1,188 @@
+# MIT License
+#
+# Copyright (c) 2023 Tim Whisonant
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""The quote daemon of the Ticker Vim plugin.
+
+Serves stock quotes to every Vim session on the machine over a Unix
+domain socket.
+"""
+
+import json
+import os
+from pathlib import Path
+import socketserver
+import threading
+import time
+from ticker_cache import (update_cache, cache_lock, ping_daemon, read_cache,
+                          get_cached_quotes, read_next_update)
+from ticker_common import ENCODING
+from ticker_fetch import close_clients
+
+
+class QuoteDaemon:
+    """Serve stock quotes to Vim sessions over a Unix domain socket.
+
+    Run with --daemon, the quote daemon owns the Finnhub session, the
+    quote cache and the refresh schedule for every Vim session on the
+    machine, so each symbol is fetched once per refresh interval no
+    matter how many Vim sessions display it. Each request is a line
+    of JSON holding g:ticker_parameters and the list of tickers, and
+    each response is a line of JSON holding the quotes. A request
+    that doesn't wait is answered with the cached quotes at once,
+    and the scheduler refreshes those that have expired. A request
+    holding only 'ping' is answered with 'pong', so that a second
+    daemon can tell whether the socket is already being served.
+    """
+
+    class Handler(socketserver.StreamRequestHandler):
+        """Answer a single quote request.
+        """
+
+        def handle(self):
+            """Read the request, then write the pong, the quotes or the error.
+            """
+            try:
+                request = json.loads(self.rfile.readline())
+                if request.get('ping'):
+                    response = {'pong': True}
+                else:
+                    quotes = self.server.quote_daemon.get_quotes(
+                        request['params'], request['tickers'],
+                        request.get('refresh', False),
+                        request.get('wait', True))
+                    response = {'quotes': {t: q.to_cache()
+                                           for t, q in quotes.items()}}
+            except Exception as exc: # pylint: disable=W0718
+                response = {'error': str(exc) or type(exc).__name__}
+            self.wfile.write(json.dumps(response).encode(ENCODING) + b'\n')
+
+    def __init__(self, socket_path: str):
+        """Initialize the daemon.
+
+        The daemon tracks the parameters and the symbols requested for
+        each quote cache file, and a condition variable that is set to
+        expire on the earliest 'next_update' of those quote caches.
+
+        Args:
+          socket_path:
+            The path of the Unix domain socket to serve.
+        """
+        self.socket_path = os.path.expanduser(socket_path)
+        self.portfolios = {}
+        self.time_to_stop = False
+        self.cond_var = threading.Condition(threading.Lock())
+
+    def get_quotes(self, params: dict, tickers: list, refresh: bool,
+                   wait: bool) -> dict:
+        """Provide the quotes for one request.
+
+        The symbols requested are added to those tracked for the
+        quote cache file, so that the cache holds the symbols of
+        every Vim session sharing it.
+
+        Args:
+          params:
+            The value of g:ticker_parameters.
+          tickers:
+            A list of stock ticker symbol strings.
+          refresh:
+            If True, refresh all of the quote data first.
+          wait:
+            If True, refresh the expired quote data first. Otherwise,
+            the cached quotes are provided at once, and the scheduler
+            is woken to refresh them if 'next_update' has passed.
+
+        Returns:
+          A dict of the stock quotes for tickers, indexed by the
+          ticker symbol.
+        """
+        with self.cond_var:
+            known = self.portfolios.get(params['quote_cache_file'], ({}, []))[1]
+            portfolio = list(dict.fromkeys(known + list(tickers)))
+            self.portfolios[params['quote_cache_file']] = (params, portfolio)
+            if len(portfolio) > len(known):
+                self.cond_var.notify()
+        if refresh:
+            with cache_lock(params['quote_cache_file']):
+                update_cache(params, portfolio)
+        if wait:
+            quotes = get_cached_quotes(params, portfolio)
+        else:
+            quotes, next_update = read_cache(params['quote_cache_file'])
+            if next_update <= time.time():
+                with self.cond_var:
+                    self.cond_var.notify()
+        return {t: quotes[t] for t in tickers if t in quotes}
+
+    def schedule(self):
+        """Refresh the tracked quotes as they expire.
+        """
+        while True:
+            with self.cond_var:
+                if self.time_to_stop:
+                    break
+                portfolios = list(self.portfolios.values())
+
+            for params, tickers in portfolios:
+                try:
+                    get_cached_quotes(params, tickers)
+                except Exception as exc: # pylint: disable=W0718
+                    print(f'ticker daemon refresh error: {exc}')
+
+            timeout = None
+            if portfolios:
+                next_update = min(read_next_update(params['quote_cache_file'])
+                                  for params, _ in portfolios)
+                timeout = max(next_update - time.time(), 1.0)
+            with self.cond_var:
+                if not self.time_to_stop:
+                    self.cond_var.wait(timeout)
+
+    def serve(self):
+        """Serve quote requests until interrupted.
+        """
+        if os.path.exists(self.socket_path):
+            if ping_daemon(self.socket_path):
+                print(f'ticker daemon already serving {self.socket_path}')
+                return
+            os.unlink(self.socket_path)
+        socket_dir = Path(self.socket_path).parent
+        if not socket_dir.exists():
+            socket_dir.mkdir(parents=True)
+
+        scheduler = threading.Thread(target=self.schedule,
+                                     name='ticker_scheduler')
+        with socketserver.ThreadingUnixStreamServer(
+                self.socket_path, QuoteDaemon.Handler) as server:
+            server.daemon_threads = True
+            server.quote_daemon = self
+            os.chmod(self.socket_path, 0o600)
+            scheduler.start()
+            try:
+                server.serve_forever()
+            finally:
+                with self.cond_var:
+                    self.time_to_stop = True
+                    self.cond_var.notify()
+                scheduler.join()
+                os.unlink(self.socket_path)
+                close_clients()
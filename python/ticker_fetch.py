@@ -0,0 +1,313 @@
+# MIT License
+#
+# Copyright (c) 2023 Tim Whisonant
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Fetching stock quotes for the Ticker Vim plugin.
+
+Quotes are requested from the Finnhub REST API, either by a pool of
+worker threads sharing a Finnhub client, or by an asyncio event loop.
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import json
+import socket
+import ssl
+import threading
+from urllib.parse import urlencode, urlsplit
+import weakref
+import finnhub
+import requests
+import urllib3
+from ticker_common import ENCODING, report
+from ticker_store import Quote
+
+
+CLIENTS = {}
+CLIENTS_LOCK = threading.Lock()
+FETCH_CANCEL = threading.Event()
+FETCH_CONNECTIONS = weakref.WeakSet()
+FETCH_CONNECTIONS_LOCK = threading.Lock()
+
+
+def get_client(rest_api_key: str, pool_size: int = 10) -> finnhub.Client:
+    """Find or create the shared Finnhub client for an API key.
+
+    Clients are kept in a registry indexed by API key, so that all
+    quote requests and all refresh cycles reuse the same HTTP
+    session and its keep-alive connections.
+
+    Args:
+      rest_api_key:
+        Finnhub REST API key
+      pool_size:
+        The number of connections kept alive by a newly created
+        client. This should be at least the number of threads that
+        use the client concurrently.
+
+    Returns:
+      The finnhub.Client for rest_api_key.
+    """
+    with CLIENTS_LOCK:
+        client = CLIENTS.get(rest_api_key)
+        if client is None:
+            client = finnhub.Client(api_key=rest_api_key)
+            adapter = CancellableAdapter(pool_connections=1,
+                                         pool_maxsize=pool_size)
+            client._session.mount('https://', adapter) # pylint: disable=W0212
+            client._session.mount('http://', adapter) # pylint: disable=W0212
+            CLIENTS[rest_api_key] = client
+        return client
+
+
+def track_connection(conn: urllib3.connection.HTTPConnection):
+    """Record a new connection, so that cancel_fetches can abort it.
+    """
+    with FETCH_CONNECTIONS_LOCK:
+        FETCH_CONNECTIONS.add(conn)
+    return conn
+
+
+class CancellableHTTPConnectionPool(urllib3.HTTPConnectionPool):
+    """An HTTPConnectionPool whose connections cancel_fetches can abort.
+    """
+
+    def _new_conn(self):
+        return track_connection(super()._new_conn())
+
+
+class CancellableHTTPSConnectionPool(urllib3.HTTPSConnectionPool):
+    """An HTTPSConnectionPool whose connections cancel_fetches can abort.
+    """
+
+    def _new_conn(self):
+        return track_connection(super()._new_conn())
+
+
+class CancellableAdapter(requests.adapters.HTTPAdapter):
+    """An HTTPAdapter whose connections cancel_fetches can abort.
+    """
+
+    def init_poolmanager(self, *pool_args, **pool_kwargs):
+        """Create the pool manager, making it use the cancellable pools.
+        """
+        super().init_poolmanager(*pool_args, **pool_kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': CancellableHTTPConnectionPool,
+            'https': CancellableHTTPSConnectionPool,
+        }
+
+
+class FetchCancelled(Exception):
+    """The wait to refresh the quote cache was ended by cancel_fetches.
+    """
+
+
+def cancel_fetches():
+    """Cancel the quote requests in flight.
+
+    Requests that haven't started fail at once, and the sockets of
+    the Finnhub clients' connections are shut down, so that requests
+    waiting on a response fail at once, too. A wait for the refresh
+    lease ends with FetchCancelled. The failures aren't reported, and
+    the cache isn't updated, until FETCH_CANCEL is cleared again.
+    """
+    FETCH_CANCEL.set()
+    with FETCH_CONNECTIONS_LOCK:
+        connections = list(FETCH_CONNECTIONS)
+    for conn in connections:
+        sock = getattr(conn, 'sock', None)
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+def close_clients():
+    """Close the shared Finnhub clients, releasing their connections.
+    """
+    with CLIENTS_LOCK:
+        for client in CLIENTS.values():
+            client.close()
+        CLIENTS.clear()
+
+
+def get_rest_quote(rest_api_key: str, ticker: str) -> dict:
+    """Use the REST API to retrieve a stock quote.
+
+    Given a Finnhub API key and a ticker symbol, retrieve
+    current quote data for that ticker symbol using the shared
+    client for the key, returning the quote dictionary.
+
+    Args:
+      rest_api_key:
+        Finnhub REST API key
+      ticker:
+        Stock ticker symbol
+
+    Returns:
+      The Quote.
+
+    Raises:
+      requests.ConnectionError: The fetch has been cancelled.
+    """
+    if FETCH_CANCEL.is_set():
+        raise requests.ConnectionError('quote fetch cancelled')
+    return Quote.from_finnhub(ticker, get_client(rest_api_key).quote(ticker))
+
+
+def get_rest_quotes(params: dict, tickers: list) -> dict:
+    """Use the REST API to retrieve quotes for several tickers.
+
+    Fetch a quote for each of the ticker symbols, using up to
+    params['fetch_workers'] concurrent requests. A failure to
+    fetch one symbol doesn't affect the others: the error is
+    reported and that symbol is left out of the result.
+
+    Args:
+      params:
+        The value of g:ticker_parameters.
+      tickers:
+        A list of stock ticker symbol strings.
+
+    Returns:
+      A dict of the successfully fetched stock quotes, indexed
+      by the ticker symbol, in the order given by tickers.
+    """
+    if params.get('refresh_engine') == 'asyncio':
+        return asyncio.run(get_async_quotes(params, tickers))
+    tickers = list(tickers)
+    rest_api_key = params['rest_api_key']
+    workers = min(max(int(params.get('fetch_workers', 1)), 1), len(tickers))
+    get_client(rest_api_key, max(workers, 10))
+    results = {}
+    if workers <= 1:
+        for t in tickers:
+            try:
+                results[t] = get_rest_quote(rest_api_key, t)
+            except Exception as exc: # pylint: disable=W0718
+                results[t] = exc
+    else:
+        with ThreadPoolExecutor(max_workers=workers,
+                                thread_name_prefix='ticker_fetch') as pool:
+            futures = [(t, pool.submit(get_rest_quote, rest_api_key, t))
+                       for t in tickers]
+            for t, future in futures:
+                exc = future.exception()
+                results[t] = exc if exc else future.result()
+
+    return collect_quotes(results)
+
+
+async def get_async_quote(rest_api_key: str, ticker: str) -> Quote:
+    """Use non-blocking HTTP to retrieve a stock quote.
+
+    The asyncio counterpart of get_rest_quote. The request is made
+    on its own connection over the running event loop, so many
+    quotes may be in flight at once without a thread apiece.
+
+    Args:
+      rest_api_key:
+        Finnhub REST API key
+      ticker:
+        Stock ticker symbol
+
+    Returns:
+      The Quote.
+    """
+    url = urlsplit(f'{finnhub.Client.API_URL}/quote?'
+                   f'{urlencode({"symbol": ticker, "token": rest_api_key})}')
+    context = ssl.create_default_context() if url.scheme == 'https' else None
+    reader, writer = await asyncio.open_connection(
+        url.hostname, url.port or (443 if context else 80), ssl=context)
+    try:
+        writer.write((f'GET {url.path}?{url.query} HTTP/1.0\r\n'
+                      f'Host: {url.hostname}\r\n'
+                      'Accept: application/json\r\n'
+                      'User-Agent: finnhub/python\r\n'
+                      '\r\n').encode('ascii'))
+        response = await reader.read()
+    finally:
+        writer.close()
+        await writer.wait_closed()
+
+    head, _, body = response.partition(b'\r\n\r\n')
+    status_line = head.split(b'\r\n', 1)[0].decode(ENCODING, 'replace')
+    if status_line.split(None, 2)[1:2] != ['200']:
+        raise finnhub.FinnhubRequestException(
+            f'Invalid Response: {status_line}')
+    return Quote.from_finnhub(ticker, json.loads(body))
+
+
+async def get_async_quotes(params: dict, tickers: list) -> dict:
+    """Use non-blocking HTTP to retrieve quotes for several tickers.
+
+    The asyncio counterpart of get_rest_quotes. All of the requests
+    are started together, and params['fetch_workers'] limits how
+    many are in flight at any one time.
+
+    Args:
+      params:
+        The value of g:ticker_parameters.
+      tickers:
+        A list of stock ticker symbol strings.
+
+    Returns:
+      A dict of the successfully fetched stock quotes, indexed
+      by the ticker symbol, in the order given by tickers.
+    """
+    tickers = list(tickers)
+    limit = asyncio.Semaphore(max(int(params.get('fetch_workers', 1)), 1))
+    timeout = finnhub.Client.DEFAULT_TIMEOUT
+
+    async def fetch(ticker: str) -> Quote:
+        async with limit:
+            return await asyncio.wait_for(
+                get_async_quote(params['rest_api_key'], ticker), timeout)
+
+    results = await asyncio.gather(*(fetch(t) for t in tickers),
+                                   return_exceptions=True)
+    return collect_quotes(dict(zip(tickers, results)))
+
+
+def collect_quotes(results: dict) -> dict:
+    """Separate the fetched quotes from the fetch errors.
+
+    Report each of the errors, unless the fetches were cancelled,
+    then return the quotes.
+
+    Args:
+      results:
+        A dict mapping each ticker symbol to either its quote
+        or the exception raised while fetching it.
+
+    Returns:
+      A dict of the successfully fetched stock quotes, indexed
+      by the ticker symbol.
+    """
+    quotes = {}
+    for t, res in results.items():
+        if not isinstance(res, BaseException):
+            quotes[t] = res
+        elif not FETCH_CANCEL.is_set():
+            report(f'ticker quote error: {t}: {str(res) or type(res).__name__}')
+    return quotes
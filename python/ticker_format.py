@@ -0,0 +1,392 @@
+# MIT License
+#
+# Copyright (c) 2023 Tim Whisonant
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Formatting stock quotes for display by the Ticker Vim plugin.
+"""
+
+import functools
+import re
+
+
+# Below this many quotes, formatting one quote at a time is faster
+# than NumPy, measured with the formats of the README.
+VECTORIZE_MIN_QUOTES = 1000
+
+# Sample finnhub quote response:
+# {
+#   'c': 47.08,     # Current price          %c
+#   'd': 1.32,      # Change                 %d
+#   'dp': 2.8846,   # Percent change         %p
+#   'h': 47.116,    # High price of the day  %h
+#   'l': 46.02,     # Low price of the day   %l
+#   'o': 46.48,     # Open price of the day  %o
+#   'pc': 45.76,    # Previous close price   %C
+#   't': 1703192401
+# }
+
+FMT_PATTERN = (r'(?P<format_specifier>'
+               r'(?P<percent>[%])'
+               r'(?:(?P<minus>[-]))?'
+               r'(?:(?P<width>[\d]+))?'
+               r'(?:(?P<dot>[.])(?P<prec>[\d]+))?'
+               r'(?P<spec>[cdphloCt%])'
+               r')')
+
+
+class FmtStringParser:
+    """Performs format string search and replace.
+
+    In the style of printf formatting for floating-point numbers,
+    convert a format string consisting of arbitrary text and
+    format specifiers to its translated form.
+
+    The set of input format specifiers is defined in the
+    specifer_to_key variable below. When a specifier string is
+    encountered in the format string, the specifier is used as
+    an index to find the correct dict key for the quote response
+    data.
+
+    The form of the format specifier is %-8.2a, where the optional
+    '-' indicates right justification, '8' indicates a total field
+    width of 8 columns, the optional '.2' indicates the number of
+    digits after the decimal point, and 'a' indicates the format
+    specifier.
+
+    Format strings are compiled once into an FmtTemplate, see
+    compile_format, so parsing the same format string again only
+    renders its template.
+    """
+
+    regex = re.compile(FMT_PATTERN)
+
+    specifier_to_key = {
+                         'c': 'c',
+                         'd': 'd',
+                         'p': 'dp',
+                         'h': 'h',
+                         'l': 'l',
+                         'o': 'o',
+                         'C': 'pc',
+                         't': 'ticker',
+                       }
+
+    def process_specifier(self, quote_data: dict, mat: re.Match) -> str:
+        """Given a matched format specifier, compute its final form.
+
+        Given a dictionary containing a quote response and an re.Match object
+        for a single format specifier, provide the string corresponding to
+        the format specifier.
+
+        Args:
+         quote_data:
+           The Quote.
+         mat:
+           An re.Match object corresponding to a matched regular
+           expression from the format specifier string.
+
+        Returns:
+          A string formatted per the input specifier.
+        """
+        gd = mat.groupdict()
+        # %% translates to %
+        value = '%' if gd['spec'] == '%' else \
+                getattr(quote_data, self.specifier_to_key[gd['spec']])
+        return format_field(value,
+                            int(gd['width']) if gd['width'] else None,
+                            int(gd['prec']) if gd['prec'] else None,
+                            bool(gd['minus']))
+
+    def parse(self, quote_data: dict, fmt: str) -> str:
+        """Convert a format specifier string to its final form.
+
+        Given a dictionary containing quote responses and a format
+        specifier string, create and return the formatted output string.
+
+        Args:
+          quote_data:
+            The Quote.
+          fmt:
+            The format string containing arbitrary text and/or
+            format specifiers.
+
+        Returns:
+          The the resulting string from converting each of the
+          format specifiers.
+        """
+        return compile_format(fmt).render(quote_data)
+
+
+def format_field(value, width: int, prec: int, right: bool) -> str:
+    """Format a single quote value.
+
+    Args:
+      value:
+        The quote value.
+      width:
+        The field width, or None for no width.
+      prec:
+        The number of digits after the decimal point, or None to
+        leave the digits as they are. Extra digits are truncated
+        rather than rounded, and missing digits are padded with 0's.
+      right:
+        True to right justify within the field width.
+
+    Returns:
+      The formatted value.
+    """
+    res = str(value)
+
+    if prec is not None and '.' in res:
+        d = res.find('.')
+        after = prec - len(res[d+1:])
+        if after > 0:
+            # Not enough precision. Pad with 0's.
+            res += '0' * after
+        else:
+            # Too much precision. Need to truncate.
+            res = res[:d+1+prec]
+
+    if width is not None:
+        # A width was specified.
+        if len(res) > width:
+            # Truncate res to width chars.
+            res = res[:width]
+        else:
+            # Pad res to width chars.
+            padding = ' ' * (width - len(res))
+            if right:
+                res = padding + res
+            else:
+                res += padding
+
+    return res
+
+
+@functools.lru_cache(maxsize=None)
+def import_numpy():
+    """Import NumPy, the first time a large portfolio is formatted.
+
+    NumPy isn't imported along with this module, which is loaded
+    each time Vim starts, since importing it takes longer than
+    formatting a typical portfolio.
+
+    Returns:
+      The numpy module, or None if NumPy isn't installed, in which
+      case large portfolios are formatted one quote at a time.
+    """
+    try:
+        import numpy # pylint: disable=C0415
+    except ImportError:
+        return None
+    return numpy
+
+
+def format_column(values: list, width: int, prec: int, right: bool):
+    """Format a column of quote values, as format_field does for one.
+
+    The values are converted by str(), which is faster than NumPy's
+    own float to str conversion. Precision is then applied to a
+    matrix of the character codes, with a row per value, by zeroing
+    the truncated digits and filling the padding digits, and NumPy's
+    fixed width str dtype takes care of the field width.
+
+    Args:
+      values:
+        The list of quote values.
+      width:
+        The field width, or None for no width.
+      prec:
+        The number of digits after the decimal point, or None to
+        leave the digits as they are.
+      right:
+        True to right justify within the field width.
+
+    Returns:
+      A numpy array of the formatted values.
+    """
+    import numpy # pylint: disable=C0415
+    res = numpy.array(list(map(str, values)), dtype=str)
+
+    if prec is not None:
+        lengths = numpy.char.str_len(res)
+        dots = numpy.char.find(res, '.')
+        ends = numpy.where(dots >= 0, dots + 1 + prec, lengths)
+        size = max(res.dtype.itemsize // 4, int(ends.max()), 1)
+        codes = res.astype(f'<U{size}').view(numpy.uint32)
+        codes = codes.reshape(len(values), size)
+        pos = numpy.arange(size)
+        codes[(pos >= lengths[:, None]) & (pos < ends[:, None])] = ord('0')
+        codes[pos >= ends[:, None]] = 0
+        res = codes.view(f'<U{size}').reshape(len(values))
+
+    if width is not None:
+        # Truncate to width chars, then pad to width chars.
+        if width == 0:
+            return numpy.full(len(values), '', dtype=str)
+        res = res.astype(f'<U{width}')
+        if right:
+            res = numpy.char.rjust(res, width)
+        else:
+            res = numpy.char.ljust(res, width)
+
+    return res
+
+
+class FmtTemplate:
+    """A format string, compiled into a list of operations.
+
+    Each operation is either a str of literal text, copied to the
+    output as is, or a tuple (key, width, prec, right) for a format
+    specifier, where key is the Quote field and the remaining
+    items are the arguments to format_field.
+    """
+
+    __slots__ = ('ops',)
+
+    def __init__(self, ops: list):
+        """Initialize the template from its operations.
+
+        Args:
+          ops:
+            The list of operations.
+        """
+        self.ops = tuple(ops)
+
+    def render(self, quote_data: dict) -> str:
+        """Format a quote using the template.
+
+        Args:
+          quote_data:
+            The Quote.
+
+        Returns:
+          The formatted quote.
+        """
+        return ''.join([op if op.__class__ is str else
+                        format_field(getattr(quote_data, op[0]), op[1], op[2], op[3])
+                        for op in self.ops])
+
+    def render_many(self, quotes: list) -> list:
+        """Format several quotes using the template.
+
+        Args:
+          quotes:
+            A list of Quotes.
+
+        Returns:
+          The list of formatted quotes.
+        """
+        fields = {op[0]: [getattr(q, op[0]) for q in quotes]
+                  for op in self.ops if op.__class__ is not str}
+        return self.render_fields(fields, len(quotes))
+
+    def render_fields(self, fields: dict, count: int) -> list:
+        """Format several quotes, given as columns, using the template.
+
+        The quotes are formatted one operation at a time, building a
+        column of strings per operation, and each row of the columns
+        is then joined into a formatted quote.
+
+        Args:
+          fields:
+            A dict mapping each Quote field to the list of its
+            values, such as QuoteStore.select returns.
+          count:
+            The number of quotes.
+
+        Returns:
+          The list of formatted quotes.
+        """
+        if count >= VECTORIZE_MIN_QUOTES and import_numpy() is not None:
+            return self.render_columns(fields, count)
+        columns = [[op] * count if op.__class__ is str else
+                   [format_field(value, op[1], op[2], op[3])
+                    for value in fields[op[0]]]
+                   for op in self.ops]
+        if not columns:
+            return [''] * count
+        return [''.join(row) for row in zip(*columns)]
+
+    def render_columns(self, fields: dict, count: int) -> list:
+        """Format several quotes, given as columns, using NumPy.
+
+        Each field column is formatted by format_column, and the
+        columns are concatenated element wise. The output is
+        identical to that of render.
+
+        Args:
+          fields:
+            A dict mapping each Quote field to the list of its
+            values, such as QuoteStore.select returns.
+          count:
+            The number of quotes.
+
+        Returns:
+          The list of formatted quotes.
+        """
+        import numpy # pylint: disable=C0415
+        res = numpy.full(count, '', dtype=str)
+        for op in self.ops:
+            if op.__class__ is str:
+                res = numpy.char.add(res, op)
+            else:
+                column = format_column(fields[op[0]], op[1], op[2], op[3])
+                res = numpy.char.add(res, column)
+        return res.tolist()
+
+
+@functools.lru_cache(maxsize=256)
+def compile_format(fmt: str) -> FmtTemplate:
+    """Compile a format string into an FmtTemplate.
+
+    The format specifiers are parsed once, and adjacent literal
+    text, including each formatted %%, is merged into a single
+    operation. Compiled templates are cached by format string.
+
+    Args:
+      fmt:
+        The format string containing arbitrary text and/or
+        format specifiers.
+
+    Returns:
+      The FmtTemplate for fmt.
+    """
+    ops = []
+    literal = ''
+    pos = 0
+    for mat in FmtStringParser.regex.finditer(fmt):
+        literal += fmt[pos:mat.start()]
+        pos = mat.end()
+        field = (int(mat['width']) if mat['width'] else None,
+                 int(mat['prec']) if mat['prec'] else None,
+                 bool(mat['minus']))
+        if mat['spec'] == '%':
+            literal += format_field('%', *field) # %% translates to %
+            continue
+        if literal:
+            ops.append(literal)
+            literal = ''
+        ops.append((FmtStringParser.specifier_to_key[mat['spec']],) + field)
+    literal += fmt[pos:]
+    if literal:
+        ops.append(literal)
+    return FmtTemplate(ops)
@@ -0,0 +1,104 @@
+# MIT License
+#
+# Copyright (c) 2023 Tim Whisonant
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""The asyncio event loop threads of the Ticker Vim plugin.
+"""
+
+import abc
+import asyncio
+import threading
+
+
+THREAD_JOIN_SECONDS = 2.0
+
+
+class EventLoopThread(abc.ABC):
+    """Run a coroutine on an asyncio event loop with its own thread.
+
+    Subclasses provide the coroutine as their main method, which
+    runs until stop cancels it. The started event is set once the
+    event loop is running. The thread is a daemon, so it never holds
+    up the exit of Vim.
+    """
+
+    def __init__(self, params: dict, name: str):
+        """Create the event loop and start its thread.
+
+        Args:
+          params:
+            The value of g:ticker_parameters.
+          name:
+            The name of the thread.
+        """
+        self.params = params
+        self.started = threading.Event()
+        self.loop = asyncio.new_event_loop()
+        self.task = self.loop.create_task(self.main())
+        self.thread = threading.Thread(target=self.run, name=name, daemon=True)
+        self.thread.start()
+
+    @abc.abstractmethod
+    async def main(self):
+        """The coroutine run by the event loop.
+        """
+
+    def run(self):
+        """Run the event loop until the main task is cancelled.
+        """
+        asyncio.set_event_loop(self.loop)
+        self.loop.call_soon(self.started.set)
+        try:
+            self.loop.run_until_complete(self.task)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self.loop.close()
+
+    def stop(self) -> bool:
+        """Cancel the main task and join the event loop thread.
+
+        Cancelling the main task closes the connections of the
+        requests it has in flight. The wait is bounded by
+        THREAD_JOIN_SECONDS.
+
+        Returns:
+          True if the thread stopped.
+        """
+        try:
+            self.loop.call_soon_threadsafe(self.task.cancel)
+        except RuntimeError: # The event loop has already closed.
+            pass
+        self.thread.join(THREAD_JOIN_SECONDS)
+        return not self.thread.is_alive()
+
+    def wait_started(self, timeout: float) -> bool:
+        """Wait for the event loop to start running.
+
+        Returns:
+          True if the event loop started within timeout seconds.
+        """
+        return self.started.wait(timeout)
+
+    def is_running(self):
+        """Is the event loop still running?
+        """
+        return self.started.is_set() and self.thread.is_alive()
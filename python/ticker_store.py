@@ -0,0 +1,323 @@
+# MIT License
+#
+# Copyright (c) 2023 Tim Whisonant
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""The stock quotes of the Ticker Vim plugin, and their binary format.
+
+Quotes are held as Quote records, and the cached quotes of a portfolio
+are kept column by column in a QuoteStore.
+"""
+
+from array import array
+from collections.abc import Mapping
+from datetime import datetime
+import re
+import struct
+import threading
+from typing import NamedTuple
+from ticker_common import TIME_FORMAT, ENCODING
+
+
+# The binary quote cache file: a header, holding the magic bytes, the
+# version, the number of quotes, the size of the symbol table and the
+# 'next_update' time, then the symbol table, which is the '\n'
+# separated ticker symbols padded to a multiple of 8 bytes, and then
+# a record per quote, in the order of the symbol table, holding the
+# quote's price fields, its timestamp, and its 'fetched' and 'expires'
+# times. Times are seconds since the epoch, with 0 for none.
+CACHE_MAGIC = b'TICKERQ\x00'
+CACHE_VERSION = 1
+CACHE_HEADER = struct.Struct('<8sIII4xd')
+CACHE_RECORD = struct.Struct('<7dqdd')
+# The 'next_update' time is the first key of a JSON quote cache file,
+# so it is found within the first CACHE_HEAD_SIZE bytes.
+CACHE_HEAD_SIZE = 64
+JSON_NEXT_UPDATE = re.compile(rb'\{\s*"next_update":\s*("[^"]*"|[-+.0-9eE]+)')
+
+
+class Quote(NamedTuple):
+    """A stock quote.
+
+    Quotes are immutable, so they are shared by the display, the
+    updater threads and the quote daemon without locks or copies:
+    a changed quote is a new Quote, made by _replace. The price
+    fields are named after the keys of the Finnhub quote response.
+    https://finnhub.io/docs/api/quote
+    """
+    ticker: str
+    c: float = 0.0
+    d: float = 0.0
+    dp: float = 0.0
+    h: float = 0.0
+    l: float = 0.0
+    o: float = 0.0
+    pc: float = 0.0
+    t: int = 0
+    fetched: float = 0.0
+    expires: float = 0.0
+
+    @classmethod
+    def from_finnhub(cls, ticker: str, response: dict) -> 'Quote':
+        """Make a Quote from a Finnhub quote response.
+
+        Finnhub reports missing values as null, which become 0.0.
+
+        Args:
+          ticker:
+            Stock ticker symbol
+          response:
+            The dict encoded in Finnhub quote response format.
+
+        Returns:
+          The Quote, with no 'fetched' or 'expires' time.
+        """
+        get = response.get
+        return cls(ticker, float(get('c') or 0.0), float(get('d') or 0.0),
+                   float(get('dp') or 0.0), float(get('h') or 0.0),
+                   float(get('l') or 0.0), float(get('o') or 0.0),
+                   float(get('pc') or 0.0), int(get('t') or 0))
+
+    @classmethod
+    def from_cache(cls, ticker: str, data: dict, expires: float) -> 'Quote':
+        """Make a Quote from its entry in the quote cache file.
+
+        Args:
+          ticker:
+            Stock ticker symbol
+          data:
+            The quote's dict in the quote cache file.
+          expires:
+            The 'expires' time for quotes cached before symbols had
+            their own, which is the cache's 'next_update'.
+
+        Returns:
+          The Quote.
+        """
+        return cls.from_finnhub(ticker, data)._replace(
+            fetched=parse_time(data.get('fetched', 0.0)),
+            expires=parse_time(data.get('expires', expires)))
+
+    def to_cache(self) -> dict:
+        """Make the quote's entry in the quote cache file.
+
+        The ticker symbol is left out, since the entry is indexed by it.
+
+        Returns:
+          The dict holding the Finnhub quote keys, together with
+          the 'fetched' and 'expires' times.
+        """
+        data = self._asdict() # pylint: disable=E1101
+        del data['ticker']
+        return data
+
+
+# The array typecode of each numeric Quote field. The other fields
+# are str's, stored in lists.
+QUOTE_COLUMNS = {'c': 'd', 'd': 'd', 'dp': 'd', 'h': 'd', 'l': 'd',
+                 'o': 'd', 'pc': 'd', 't': 'q', 'fetched': 'd', 'expires': 'd'}
+
+
+def parse_time(value) -> float:
+    """Convert a time from the quote cache file to seconds since the epoch.
+
+    Times are stored as seconds since the epoch, with 0 for none. Quote
+    cache files written by earlier versions of Ticker hold them as local
+    TIME_FORMAT strings instead, with '' for none, and those are still
+    accepted.
+    """
+    if isinstance(value, str):
+        return datetime.strptime(value, TIME_FORMAT).timestamp() if value else 0.0
+    return float(value)
+
+
+class QuoteStore(Mapping):
+    """The cached quotes, stored a column per Quote field.
+
+    The numeric fields are held in arrays, and the ticker symbols in
+    a list, with a row per ticker symbol and a dict indexing the rows
+    by symbol. Quotes are updated in place, so a refresh costs only
+    the rows it changes, and the quotes are formatted straight from
+    the columns, without making a Quote apiece.
+
+    The store is a Mapping from ticker symbol to Quote, and it is
+    shared between threads: each method holds the store's lock.
+    """
+
+    def __init__(self, quotes: list = ()):
+        """Initialize the store.
+
+        Args:
+          quotes:
+            The Quotes to store.
+        """
+        self.lock = threading.Lock()
+        self.index = {}
+        self.columns = {f: array(QUOTE_COLUMNS[f]) if f in QUOTE_COLUMNS else []
+                        for f in Quote._fields}
+        self.update(quotes)
+
+    def __getitem__(self, ticker: str) -> Quote:
+        with self.lock:
+            row = self.index[ticker]
+            return Quote(*(column[row] for column in self.columns.values()))
+
+    def __contains__(self, ticker) -> bool:
+        return ticker in self.index
+
+    def __iter__(self):
+        with self.lock:
+            return iter(self.columns['ticker'][:])
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def update(self, quotes: list):
+        """Store quotes, replacing those stored for the same symbols.
+
+        Args:
+          quotes:
+            The Quotes to store.
+        """
+        with self.lock:
+            for quote in quotes:
+                row = self.index.get(quote.ticker)
+                if row is None:
+                    self.index[quote.ticker] = len(self.index)
+                    for column, value in zip(self.columns.values(), quote):
+                        column.append(value)
+                else:
+                    for column, value in zip(self.columns.values(), quote):
+                        column[row] = value
+
+    def retain(self, tickers: list):
+        """Drop the quotes for the symbols that aren't in tickers.
+
+        Args:
+          tickers:
+            A list of stock ticker symbol strings.
+        """
+        with self.lock:
+            rows = sorted(self.index[t] for t in set(tickers) if t in self.index)
+            if len(rows) == len(self.index):
+                return
+            for f, column in self.columns.items():
+                self.columns[f] = [column[r] for r in rows] \
+                    if isinstance(column, list) else \
+                    array(column.typecode, (column[r] for r in rows))
+            self.index = {t: r for r, t in enumerate(self.columns['ticker'])}
+
+    def select(self, tickers: list) -> dict:
+        """Read the columns for several symbols at once.
+
+        The columns are read together, under the lock, so that they
+        are consistent with one another.
+
+        Args:
+          tickers:
+            A list of stock ticker symbol strings. Those that aren't
+            stored are skipped.
+
+        Returns:
+          A dict mapping each Quote field to the list of its values,
+          a value per stored symbol, in the order given by tickers.
+        """
+        with self.lock:
+            rows = [self.index[t] for t in tickers if t in self.index]
+            if rows == list(range(len(self.index))):
+                return {f: column.tolist() if isinstance(column, array) else
+                        column[:] for f, column in self.columns.items()}
+            return {f: [column[r] for r in rows]
+                    for f, column in self.columns.items()}
+
+
+def pack_cache(quotes: QuoteStore, next_update: float) -> bytes:
+    """Encode the quote cache in the binary format.
+
+    Args:
+      quotes:
+        The QuoteStore of the stock quotes.
+      next_update:
+        The 'next_update' time, in seconds since the epoch.
+
+    Returns:
+      The contents of the binary quote cache file.
+    """
+    fields = quotes.select(list(quotes))
+    symbols = '\n'.join(fields['ticker']).encode(ENCODING)
+    symbols += b'\x00' * (-len(symbols) % 8)
+    data = bytearray(CACHE_HEADER.pack(CACHE_MAGIC, CACHE_VERSION,
+                                       len(fields['ticker']), len(symbols),
+                                       next_update))
+    data += symbols
+    for record in zip(fields['c'], fields['d'], fields['dp'], fields['h'],
+                      fields['l'], fields['o'], fields['pc'], fields['t'],
+                      fields['fetched'], fields['expires']):
+        data += CACHE_RECORD.pack(*record)
+    return bytes(data)
+
+
+def unpack_cache(data) -> tuple:
+    """Decode a binary quote cache.
+
+    Args:
+      data:
+        The contents of the binary quote cache file, such as an mmap.
+
+    Returns:
+      A tuple of the QuoteStore of the cached stock quotes and the
+      'next_update' time.
+
+    Raises:
+      ValueError: The data isn't a complete binary quote cache of
+        this version.
+    """
+    count, size, next_update = unpack_cache_header(data)
+    start = CACHE_HEADER.size + size
+    end = start + count * CACHE_RECORD.size
+    symbols = data[CACHE_HEADER.size:start].rstrip(b'\x00')
+    symbols = symbols.decode(ENCODING).split('\n') if count else []
+    if len(symbols) != count or len(data) < end:
+        raise ValueError('truncated binary quote cache')
+    records = CACHE_RECORD.iter_unpack(data[start:end])
+    quotes = QuoteStore(Quote(t, *record) for t, record in zip(symbols, records))
+    return quotes, next_update
+
+
+def unpack_cache_header(data: bytes) -> tuple:
+    """Decode the header of a binary quote cache.
+
+    Args:
+      data:
+        The start of the binary quote cache file.
+
+    Returns:
+      A tuple of the number of quotes, the size of the symbol table,
+      and the 'next_update' time.
+
+    Raises:
+      ValueError: The data isn't a binary quote cache of this version.
+    """
+    if len(data) < CACHE_HEADER.size:
+        raise ValueError('truncated binary quote cache')
+    magic, version, count, size, next_update = CACHE_HEADER.unpack_from(data)
+    if magic != CACHE_MAGIC or version != CACHE_VERSION:
+        raise ValueError(f'unsupported binary quote cache version {version}')
+    return count, size, next_update
@@ -0,0 +1,161 @@
+# MIT License
+#
+# Copyright (c) 2023 Tim Whisonant
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""A minimal WebSocket client for the Ticker Vim plugin.
+
+Just enough of RFC 6455 to follow the Finnhub trade feed, using the
+streams of asyncio.
+"""
+
+import asyncio
+import base64
+import hashlib
+import os
+import ssl
+from urllib.parse import urlsplit
+from ticker_common import ENCODING
+
+
+WEBSOCKET_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+
+def websocket_accept(key: str) -> str:
+    """Compute the Sec-WebSocket-Accept value for a handshake key.
+    """
+    digest = hashlib.sha1((key + WEBSOCKET_GUID).encode('ascii')).digest()
+    return base64.b64encode(digest).decode('ascii')
+
+
+async def websocket_connect(url: str) -> tuple:
+    """Open a WebSocket connection.
+
+    Args:
+      url:
+        A ws:// or wss:// URL.
+
+    Returns:
+      The asyncio (reader, writer) pair of the connection, after
+      a successful opening handshake.
+    """
+    url = urlsplit(url)
+    context = ssl.create_default_context() if url.scheme == 'wss' else None
+    reader, writer = await asyncio.open_connection(
+        url.hostname, url.port or (443 if context else 80), ssl=context)
+    key = base64.b64encode(os.urandom(16)).decode('ascii')
+    writer.write((f'GET {url.path or "/"}{"?" if url.query else ""}{url.query} '
+                  'HTTP/1.1\r\n'
+                  f'Host: {url.netloc}\r\n'
+                  'Upgrade: websocket\r\n'
+                  'Connection: Upgrade\r\n'
+                  f'Sec-WebSocket-Key: {key}\r\n'
+                  'Sec-WebSocket-Version: 13\r\n'
+                  '\r\n').encode('ascii'))
+    head = (await reader.readuntil(b'\r\n\r\n')).decode(ENCODING, 'replace')
+    status_line = head.split('\r\n', 1)[0]
+    if status_line.split(None, 2)[1:2] != ['101'] or \
+       websocket_accept(key) not in head:
+        writer.close()
+        raise ConnectionError(f'WebSocket handshake failed: {status_line}')
+    return reader, writer
+
+
+async def websocket_send(writer: asyncio.StreamWriter, data,
+                         opcode: int = 0x1, masked: bool = True):
+    """Send one WebSocket frame.
+
+    Args:
+      writer:
+        The connection's asyncio.StreamWriter.
+      data:
+        The payload, either a str or bytes.
+      opcode:
+        The frame opcode, by default a text frame.
+      masked:
+        Whether to mask the payload, as clients must.
+    """
+    if isinstance(data, str):
+        data = data.encode(ENCODING)
+    length = len(data)
+    header = bytearray([0x80 | opcode])
+    if length < 126:
+        header.append(length)
+    elif length < 65536:
+        header.append(126)
+        header += length.to_bytes(2, 'big')
+    else:
+        header.append(127)
+        header += length.to_bytes(8, 'big')
+    if masked:
+        mask = os.urandom(4)
+        header[1] |= 0x80
+        header += mask
+        data = websocket_mask(data, mask)
+    writer.write(bytes(header) + data)
+    await writer.drain()
+
+
+async def websocket_receive(reader: asyncio.StreamReader,
+                            writer: asyncio.StreamWriter) -> str:
+    """Receive the next WebSocket text message.
+
+    Pings are answered, and other control frames are skipped.
+
+    Args:
+      reader:
+        The connection's asyncio.StreamReader.
+      writer:
+        The connection's asyncio.StreamWriter.
+
+    Returns:
+      The message text, or None when the connection is closed.
+    """
+    message = b''
+    while True:
+        head = await reader.readexactly(2)
+        opcode = head[0] & 0x0f
+        length = head[1] & 0x7f
+        if length == 126:
+            length = int.from_bytes(await reader.readexactly(2), 'big')
+        elif length == 127:
+            length = int.from_bytes(await reader.readexactly(8), 'big')
+        mask = await reader.readexactly(4) if head[1] & 0x80 else None
+        data = await reader.readexactly(length)
+        if mask:
+            data = websocket_mask(data, mask)
+
+        if opcode == 0x8:
+            return None
+        if opcode == 0x9:
+            await websocket_send(writer, data, 0xa)
+        elif opcode < 0x8:
+            message += data
+            if head[0] & 0x80:
+                return message.decode(ENCODING)
+
+
+def websocket_mask(data: bytes, mask: bytes) -> bytes:
+    """Apply a WebSocket masking key to a payload.
+    """
+    length = len(data)
+    key = (mask * (length // 4 + 1))[:length]
+    return (int.from_bytes(data, 'big') ^
+            int.from_bytes(key, 'big')).to_bytes(length, 'big')